@@ -3,5 +3,15 @@ set -e
 
 echo "Starting Python LSP Server on $PYLSP_HOST:$PYLSP_PORT..."
 
-# Disable check-parent-process as it can cause issues in Docker
-exec python -m pylsp --tcp --host "$PYLSP_HOST" --port "$PYLSP_PORT" --verbose
\ No newline at end of file
+# The supervisor owns the port and runs one pylsp worker per session over stdio
+# With tracing on, workers run pylsp through lsp_trace so they report per-request and per-hook timings
+# (same rule as SupervisorConfig.from_env: empty, 0, false, no and off mean disabled)
+case "$(printf '%s' "${PYLSP_TRACE:-0}" | tr '[:upper:]' '[:lower:]' | tr -d '[:space:]')" in
+  ""|0|false|no|off)
+    export PYLSP_WORKER_COMMAND="${PYLSP_WORKER_COMMAND:-python -m pylsp --verbose}"
+    ;;
+  *)
+    export PYLSP_WORKER_COMMAND="${PYLSP_WORKER_COMMAND:-python /app/lsp_trace.py --verbose}"
+    ;;
+esac
+exec python /app/lsp_supervisor.py
@@ -1,9 +1,9 @@
 #!/bin/sh
 set -e
 
-# First check if the process is running
-if ! pgrep -f "python -m pylsp" > /dev/null; then
-  echo "Python LSP Server process is not running"
+# Ready means a pylsp worker has answered a real initialize + hover round trip
+if ! python -c "import urllib.request; urllib.request.urlopen('http://127.0.0.1:${PYLSP_HEALTH_PORT:-3002}/readyz', timeout=2)" 2>/dev/null; then
+  echo "Python LSP Server has no ready worker"
   exit 1
 fi
 
@@ -14,4 +14,4 @@ if nc -z localhost "$PYLSP_PORT"; then
 else
   echo "Python LSP Server is not available on port $PYLSP_PORT"
   exit 1
-fi
\ No newline at end of file
+fi
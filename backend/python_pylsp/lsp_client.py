@@ -0,0 +1,383 @@
+"""Pipelined asyncio client for the Language Server Protocol.
+
+Speaks JSON-RPC 2.0 over TCP with LSP's ``Content-Length`` framing. Incoming
+bytes are received straight into a growable ``bytearray`` through
+``asyncio.BufferedProtocol`` and decoded in place through ``memoryview``
+slices, so large completion or symbol responses cost linear time no matter
+how they are split across reads. Any number of requests can be in flight at
+once; responses are matched back to their request by id, and server
+notifications are delivered to subscribers.
+
+Example::
+
+    client = await LspClient.connect("localhost", 3000)
+    await client.initialize({"rootUri": "file:///app/workspace", "capabilities": {}})
+    diagnostics = client.subscribe("textDocument/publishDiagnostics")
+    hover, completion = await asyncio.gather(
+        client.request("textDocument/hover", hover_params),
+        client.request("textDocument/completion", completion_params),
+    )
+    message = await diagnostics.get(timeout=5)
+    await client.close()
+"""
+import asyncio
+import itertools
+import json
+import os
+
+HEADER_SEPARATOR = b"\r\n\r\n"
+CONTENT_LENGTH = b"content-length"
+DEFAULT_TIMEOUT = 10  # seconds
+READ_CHUNK = 64 * 1024
+
+
+class LspProtocolError(ValueError):
+    """The byte stream is not valid LSP framing or JSON-RPC"""
+
+
+class LspResponseError(Exception):
+    """The server answered a request with a JSON-RPC error object"""
+
+    def __init__(self, code, message, data=None):
+        super().__init__(f"{message} (code {code})")
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def encode_message(message):
+    """Frame a JSON-RPC message; Content-Length counts UTF-8 bytes, not characters"""
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+class MessageBuffer:
+    """Incremental decoder for Content-Length framed messages.
+
+    Data lives in one ``bytearray`` between a read offset and a write offset.
+    ``get_buffer``/``buffer_updated`` let a socket write into the free tail
+    directly; consumed bytes are reclaimed by sliding the unread remainder to
+    the front only when space runs out, never per message.
+    """
+
+    def __init__(self, initial_size=READ_CHUNK):
+        self._buf = bytearray(initial_size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def get_buffer(self, sizehint=-1):
+        """Return a writable view of at least ``sizehint`` free bytes"""
+        needed = max(sizehint, READ_CHUNK)
+        if len(self._buf) - self._end < needed:
+            pending = self._end - self._start
+            if pending + needed <= len(self._buf) and self._start:
+                # Same-length slice assignment never resizes, so it is safe even
+                # while an earlier view handed to the transport is still alive
+                self._buf[:pending] = self._buf[self._start:self._end]
+            else:
+                grown = bytearray(max(len(self._buf) * 2, pending + needed))
+                grown[:pending] = self._buf[self._start:self._end]
+                self._buf = grown
+            self._start, self._end = 0, pending
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """Account for ``nbytes`` written into the view from ``get_buffer``"""
+        self._end += nbytes
+
+    def feed(self, data):
+        """Append bytes received by other means (plain sockets, tests)"""
+        view = self.get_buffer(len(data))
+        view[:len(data)] = data
+        self.buffer_updated(len(data))
+
+    def next_message(self):
+        """Decode and return the next complete message, or None if more data is needed"""
+        header_end = self._buf.find(HEADER_SEPARATOR, self._start, self._end)
+        if header_end == -1:
+            return None
+
+        content_length = None
+        for line in self._buf[self._start:header_end].split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == CONTENT_LENGTH:
+                try:
+                    content_length = int(value.strip())
+                except ValueError:
+                    raise LspProtocolError(f"Invalid Content-Length header: {line!r}")
+        if content_length is None or content_length < 0:
+            raise LspProtocolError("Message header has no valid Content-Length")
+
+        body_start = header_end + len(HEADER_SEPARATOR)
+        body_end = body_start + content_length
+        if body_end > self._end:
+            return None
+
+        with memoryview(self._buf) as view:
+            try:
+                body = str(view[body_start:body_end], "utf-8")
+            except UnicodeDecodeError as e:
+                raise LspProtocolError(f"Message body is not valid UTF-8: {e}")
+        self._start = body_end
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError as e:
+            raise LspProtocolError(f"Message body is not valid JSON: {e}")
+
+    def messages(self):
+        """Yield every complete message currently buffered"""
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+
+_END = object()  # queued once a subscription's connection is gone
+
+
+class Subscription:
+    """Stream of server notifications for one method (or all, if method is None)"""
+
+    def __init__(self, client, method, callback=None):
+        self._client = client
+        self.method = method
+        self.callback = callback
+        self.queue = asyncio.Queue()
+        self.error = None
+
+    def deliver(self, message):
+        if self.callback is not None:
+            self.callback(message)
+        else:
+            self.queue.put_nowait(message)
+
+    def end(self, exc):
+        """The connection is gone: wake up every waiter once the queued messages are read"""
+        if self.error is None:
+            self.error = exc
+            self.queue.put_nowait(_END)
+
+    async def _next(self, timeout=None):
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        if message is _END:
+            # Leave the marker in place so later calls end too
+            self.queue.put_nowait(_END)
+        return message
+
+    async def get(self, timeout=None):
+        """Wait for the next notification message; raises ConnectionError once the connection is gone"""
+        message = await self._next(timeout)
+        if message is _END:
+            raise ConnectionError(f"LSP connection closed: {self.error}")
+        return message
+
+    def drain(self):
+        """Take every queued notification without waiting; the end of the connection stays queued"""
+        messages = []
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if message is _END:
+                self.queue.put_nowait(_END)
+                break
+            messages.append(message)
+        return messages
+
+    def close(self):
+        """Stop receiving notifications"""
+        self._client.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._next()
+        if message is _END:
+            raise StopAsyncIteration
+        return message
+
+
+class _LspClientProtocol(asyncio.BufferedProtocol):
+    def __init__(self, client):
+        self._client = client
+        self._buffer = MessageBuffer()
+
+    def get_buffer(self, sizehint):
+        return self._buffer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self._buffer.buffer_updated(nbytes)
+        try:
+            for message in self._buffer.messages():
+                self._client._dispatch(message)
+        except LspProtocolError as e:
+            self._client._fail(e)
+
+    def connection_lost(self, exc):
+        self._client._fail(exc or ConnectionError("Connection closed by server"))
+
+
+class LspClient:
+    """Asynchronous LSP client supporting many concurrent requests"""
+
+    def __init__(self, transport=None):
+        self._transport = transport
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._subscriptions = {}
+        self._request_handlers = {}
+        self._error = None
+
+    @classmethod
+    async def connect(cls, host, port, timeout=DEFAULT_TIMEOUT):
+        """Open a TCP connection to a language server"""
+        loop = asyncio.get_running_loop()
+        client = cls()
+        transport, _ = await asyncio.wait_for(
+            loop.create_connection(lambda: _LspClientProtocol(client), host, port), timeout
+        )
+        client._transport = transport
+        return client
+
+    @property
+    def closed(self):
+        return self._transport is None or self._transport.is_closing()
+
+    def _write(self, message):
+        if self._error is not None:
+            raise ConnectionError(f"LSP connection failed: {self._error}")
+        if self.closed:
+            raise ConnectionError("LSP connection is closed")
+        self._transport.write(encode_message(message))
+
+    def _send_request(self, method, params):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._write({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+        except ConnectionError:
+            del self._pending[request_id]
+            raise
+        return request_id, future
+
+    def send_request(self, method, params=None):
+        """Send a request and return a future resolving to the full response message"""
+        return self._send_request(method, params)[1]
+
+    async def request(self, method, params=None, timeout=DEFAULT_TIMEOUT):
+        """Send a request and return its result, raising LspResponseError on error replies"""
+        request_id, future = self._send_request(method, params)
+        try:
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(request_id, None)
+            raise TimeoutError(f"Timeout waiting for {method} response")
+        if "error" in response:
+            error = response["error"]
+            raise LspResponseError(error.get("code"), error.get("message"), error.get("data"))
+        return response.get("result")
+
+    def notify(self, method, params=None):
+        """Send a notification (no response expected)"""
+        self._write({"jsonrpc": "2.0", "method": method, "params": params})
+
+    def subscribe(self, method=None, callback=None):
+        """Receive notifications for ``method`` (all methods if None).
+
+        With a callback, each notification message is passed to it as it
+        arrives; otherwise messages queue up on the returned subscription.
+        """
+        subscription = Subscription(self, method, callback)
+        self._subscriptions.setdefault(method, []).append(subscription)
+        if self._transport is not None and self.closed:
+            subscription.end(self._error or ConnectionError("LSP connection is closed"))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.method, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+
+    def on_request(self, method, handler):
+        """Answer server-to-client requests for ``method`` with ``handler(params)``.
+
+        Requests without a handler are answered with a null result so the
+        server never blocks waiting on us.
+        """
+        self._request_handlers[method] = handler
+
+    async def initialize(self, params, timeout=DEFAULT_TIMEOUT):
+        """Run the initialize/initialized handshake and return the server capabilities"""
+        params = dict({"processId": os.getpid(), "rootUri": None, "capabilities": {}}, **params)
+        result = await self.request("initialize", params, timeout=timeout)
+        self.notify("initialized", {})
+        return result.get("capabilities", {})
+
+    async def shutdown(self, timeout=DEFAULT_TIMEOUT):
+        """Ask the server to shut down, then close the connection"""
+        try:
+            await self.request("shutdown", None, timeout=timeout)
+            self.notify("exit", None)
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Close the connection and fail any requests still waiting"""
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.close()
+            # Let connection_lost run so the socket is released before returning
+            await asyncio.sleep(0)
+        self._fail(ConnectionError("LSP connection closed"))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _dispatch(self, message):
+        if "method" not in message:
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+            return
+
+        if "id" in message:
+            self._answer(message)
+            return
+
+        for key in (message["method"], None):
+            for subscription in list(self._subscriptions.get(key, ())):
+                subscription.deliver(message)
+
+    def _answer(self, message):
+        handler = self._request_handlers.get(message["method"])
+        response = {"jsonrpc": "2.0", "id": message["id"], "result": None}
+        if handler is not None:
+            try:
+                response["result"] = handler(message.get("params"))
+            except Exception as e:
+                del response["result"]
+                response["error"] = {"code": -32603, "message": str(e)}
+        if not self.closed:
+            self._transport.write(encode_message(response))
+
+    def _fail(self, exc):
+        if self._error is None and not isinstance(exc, ConnectionError):
+            self._error = exc
+            if self._transport is not None:
+                self._transport.close()
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc if isinstance(exc, Exception) else ConnectionError(exc))
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.end(exc)
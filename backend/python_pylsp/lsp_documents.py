@@ -0,0 +1,152 @@
+"""Shadow copies of the text documents a client has open.
+
+Anything that sits between the editor and pylsp and needs to know what the
+buffers contain (worker handover, caches, indexes) keeps a ``TextDocument``
+per URI and feeds it the ``didOpen``/``didChange`` notifications it relays.
+Positions follow the LSP default encoding: zero-based lines, and characters
+counted in UTF-16 code units.
+"""
+import re
+from urllib.parse import unquote, urlparse
+
+LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def uri_to_path(uri):
+    """Filesystem path of a ``file://`` URI, or None for other schemes"""
+    if not uri:
+        return None
+    parsed = urlparse(uri)
+    if parsed.scheme != "file":
+        return None
+    return unquote(parsed.path)
+
+
+def utf16_to_index(line, character):
+    """Convert a UTF-16 column into a code point index within ``line``"""
+    if line.isascii():
+        return min(character, len(line))
+    units = 0
+    for index, char in enumerate(line):
+        if units >= character:
+            return index
+        units += 2 if ord(char) > 0xFFFF else 1
+    return len(line)
+
+
+def line_starts(text):
+    """Offsets at which each line of ``text`` begins"""
+    return [0] + [match.end() for match in LINE_BREAK.finditer(text)]
+
+
+def position_to_offset(text, position, starts=None):
+    """Offset into ``text`` of an LSP position, clamped to the document"""
+    if starts is None:
+        starts = line_starts(text)
+    line = position["line"]
+    if line < 0:
+        return 0
+    if line >= len(starts):
+        return len(text)
+    start = starts[line]
+    end = starts[line + 1] if line + 1 < len(starts) else len(text)
+    content = LINE_BREAK.sub("", text[start:end], count=1)
+    return start + utf16_to_index(content, position["character"])
+
+
+def apply_change(text, change):
+    """Apply one ``TextDocumentContentChangeEvent`` and return the new text"""
+    if "range" not in change or change["range"] is None:
+        return change["text"]
+    starts = line_starts(text)
+    start = position_to_offset(text, change["range"]["start"], starts)
+    end = position_to_offset(text, change["range"]["end"], starts)
+    return text[:start] + change["text"] + text[max(start, end):]
+
+
+def apply_edits(text, edits):
+    """Apply a list of non-overlapping ``TextEdit``s that all refer to ``text``"""
+    starts = line_starts(text)
+    spans = sorted(
+        (
+            position_to_offset(text, edit["range"]["start"], starts),
+            position_to_offset(text, edit["range"]["end"], starts),
+            edit["newText"],
+        )
+        for edit in edits
+    )
+    pieces = []
+    cursor = 0
+    for start, end, new_text in spans:
+        pieces.append(text[cursor:start])
+        pieces.append(new_text)
+        cursor = max(cursor, end)
+    pieces.append(text[cursor:])
+    return "".join(pieces)
+
+
+class TextDocument:
+    """Current text and version of one open document"""
+
+    def __init__(self, uri, language_id, version, text):
+        self.uri = uri
+        self.language_id = language_id
+        self.version = version
+        self.text = text
+
+    @classmethod
+    def from_item(cls, item):
+        """Build from the ``textDocument`` of a ``didOpen`` notification"""
+        return cls(item["uri"], item.get("languageId", "python"), item.get("version", 0), item["text"])
+
+    def to_item(self):
+        """The ``TextDocumentItem`` to replay this document with ``didOpen``"""
+        return {
+            "uri": self.uri,
+            "languageId": self.language_id,
+            "version": self.version,
+            "text": self.text,
+        }
+
+    def apply_changes(self, changes, version=None):
+        """Apply the ``contentChanges`` of a ``didChange`` notification in order"""
+        for change in changes:
+            self.text = apply_change(self.text, change)
+        if version is not None:
+            self.version = version
+
+    def offset_at(self, position):
+        return position_to_offset(self.text, position)
+
+
+class DocumentStore:
+    """Open documents of one session, updated from the notifications it sends"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def __contains__(self, uri):
+        return uri in self.documents
+
+    def __iter__(self):
+        return iter(self.documents.values())
+
+    def get(self, uri):
+        return self.documents.get(uri)
+
+    def observe(self, message):
+        """Update the store from a client notification; returns the touched document"""
+        method = message.get("method")
+        params = message.get("params") or {}
+        if method == "textDocument/didOpen":
+            document = TextDocument.from_item(params["textDocument"])
+            self.documents[document.uri] = document
+            return document
+        if method == "textDocument/didChange":
+            document = self.documents.get(params["textDocument"]["uri"])
+            if document is not None:
+                document.apply_changes(params["contentChanges"], params["textDocument"].get("version"))
+            return document
+        if method == "textDocument/didClose":
+            return self.documents.pop(params["textDocument"]["uri"], None)
+        return None
@@ -0,0 +1,134 @@
+"""Content-addressed cache of ``textDocument/formatting`` results.
+
+Formatting through pylsp runs black/isort/ruff over the whole buffer on
+every request, even when the text has not changed since the last format or
+is already formatted. Results are cached under a hash of the document text,
+the request's formatting options and a fingerprint of the formatter
+configuration: ``pyproject.toml`` and friends in the document's directory and
+every directory above it (black and isort use the nearest one), the
+workspace root, and the pylsp settings the client sent through
+``initializationOptions`` and ``workspace/didChangeConfiguration``. Since formatters are idempotent, the text a
+result produces is also cached as needing no edits, so formatting a buffer
+twice answers the second request with an empty edit list without asking
+pylsp. Entries are evicted least recently used first once the cached edits
+exceed a size budget.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from lsp_documents import apply_edits
+
+MB = 1024 * 1024
+# Files black, isort and ruff read their settings from
+FORMATTER_CONFIG_FILES = ("pyproject.toml", "setup.cfg", ".isort.cfg", "ruff.toml", ".ruff.toml")
+# Rough per-entry bookkeeping cost (key, tuple, dict slot) counted against the budget
+ENTRY_OVERHEAD = 200
+
+
+class FormatCache:
+    """Bounded LRU mapping (text, options, configuration) to formatting edits"""
+
+    def __init__(self, max_bytes=32 * MB, max_entries=10000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._file_digests = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _file_digest(self, path):
+        """Digest of a config file, re-read only when its mtime or size changes"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "missing"
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        except OSError:
+            return "missing"
+        self._file_digests[path] = (signature, digest)
+        return digest
+
+    @staticmethod
+    def config_directories(root_path, document_path=None):
+        """Directories whose config files may apply: the document's, its ancestors and the root"""
+        directories = []
+        if document_path:
+            directory = os.path.dirname(os.path.abspath(document_path))
+            while directory not in directories:
+                directories.append(directory)
+                directory = os.path.dirname(directory)
+        if root_path and os.path.abspath(root_path) not in directories:
+            directories.append(os.path.abspath(root_path))
+        return directories
+
+    def fingerprint(self, root_path, settings=None, document_path=None):
+        """Hash of everything other than the text that can change formatter output"""
+        digest = hashlib.blake2b(digest_size=16)
+        for directory in self.config_directories(root_path, document_path):
+            for name in FORMATTER_CONFIG_FILES:
+                path = os.path.join(directory, name)
+                digest.update(f"{path}={self._file_digest(path)};".encode())
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(text, options, fingerprint):
+        digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=20)
+        digest.update(b"\0" + json.dumps(options, sort_keys=True).encode())
+        digest.update(b"\0" + fingerprint.encode())
+        return digest.digest()
+
+    def get(self, text, options, fingerprint):
+        """Cached edits for ``text``, or None on a miss"""
+        key = self.key(text, options, fingerprint)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def store(self, text, options, fingerprint, edits):
+        """Remember ``edits`` for ``text``, and that the text they produce is already formatted"""
+        self._put(self.key(text, options, fingerprint), edits)
+        if edits:
+            formatted = apply_edits(text, edits)
+            if formatted != text:
+                self._put(self.key(formatted, options, fingerprint), [])
+
+    def _put(self, key, edits):
+        size = ENTRY_OVERHEAD + sum(len(edit.get("newText", "")) for edit in edits)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+        self._entries[key] = (edits, size)
+        self.size += size
+        while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size_mb": round(self.size / MB, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,974 @@
+"""Supervisor that fronts pylsp on the LSP port and keeps its workers healthy.
+
+pylsp's own ``--tcp`` mode serves one connection at a time from one
+long-lived process, whose memory grows with Jedi/rope caches and which can be
+wedged by a long mypy run while still accepting connections. The supervisor
+listens on ``PYLSP_PORT`` instead and gives every editor session a dedicated
+pylsp worker spoken to over stdio. For each worker it:
+
+- tracks resident memory (the worker plus its child processes), the number
+  of requests served and their latency;
+- probes it with real LSP round trips: ``initialize`` when it starts, then a
+  periodic ``textDocument/hover`` on a private probe document, queued behind
+  the session's own requests;
+- recycles it once memory, request-count, latency or probe-failure
+  thresholds are crossed. The session is handed over to a fresh worker: new
+  messages are held back, in-flight requests are given a chance to finish,
+  and the new worker is sent the session's ``initialize`` parameters and
+  every open document before traffic resumes.
+
+Warm spare workers (already imported, initialized and probed) are kept so new
+sessions and handovers don't pay pylsp's start-up cost. Formatting requests
+for text that was formatted before are answered from a shared
+``FormatCache`` without reaching a worker, and ``workspace/symbol`` as well as
+references to the top-level names of workspace modules are answered from a
+persistent ``SymbolIndex`` of the workspace. ``/healthz``, ``/readyz``, ``/status`` and
+Prometheus ``/metrics`` are served over HTTP on ``PYLSP_HEALTH_PORT``; with
+``PYLSP_TRACE`` set, a ``Tracer`` times every request phase by phase (see
+``lsp_trace``).
+"""
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import shlex
+import signal
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+
+from lsp_client import READ_CHUNK, LspProtocolError, LspResponseError, MessageBuffer, encode_message
+from lsp_documents import DocumentStore, uri_to_path
+from lsp_format_cache import FormatCache
+from lsp_symbol_index import SymbolIndex
+from lsp_trace import TIMING_FIELD, TIMING_NOTIFICATION, Tracer, metric_lines
+
+log = logging.getLogger("lsp_supervisor")
+
+MB = 1024 * 1024
+FALSE_VALUES = ("0", "false", "no", "off")
+CONTENT_MODIFIED = -32801
+INTERNAL_ERROR = -32603
+PROBE_FILENAME = ".pylsp-probe.py"
+PROBE_TEXT = '''def readiness_probe() -> int:
+    """Language server readiness probe."""
+    return 1
+
+
+readiness_probe()
+'''
+PROBE_POSITION = {"line": 5, "character": 3}
+
+
+class ProbeFailed(Exception):
+    """A readiness probe got an answer, but not a usable one"""
+
+
+@dataclass
+class SupervisorConfig:
+    host: str = "0.0.0.0"
+    port: int = 3000
+    health_port: int = 3002
+    worker_command: list = field(default_factory=lambda: [sys.executable, "-m", "pylsp"])
+    root_uri: str = "file:///app/workspace"
+    spare_workers: int = 1
+    max_sessions: int = 8
+    max_rss_mb: float = 1024.0
+    max_requests: int = 10000
+    max_p95_ms: float = 5000.0
+    latency_window: int = 200
+    min_latency_samples: int = 20
+    probe_interval: float = 15.0
+    probe_timeout: float = 10.0
+    probe_failures: int = 2
+    start_timeout: float = 60.0
+    drain_timeout: float = 10.0
+    format_cache_mb: float = 32.0
+    symbol_index: bool = True
+    index_path: str = ""
+    index_rescan_interval: float = 30.0
+    trace: bool = False
+    trace_path: str = ""
+    trace_max_mb: float = 64.0
+    monitor_interval: float = 5.0
+
+    ENVIRONMENT = {
+        "host": "PYLSP_HOST",
+        "port": "PYLSP_PORT",
+        "health_port": "PYLSP_HEALTH_PORT",
+        "worker_command": "PYLSP_WORKER_COMMAND",
+        "root_uri": "PYLSP_ROOT_URI",
+        "spare_workers": "PYLSP_SPARE_WORKERS",
+        "max_sessions": "PYLSP_MAX_SESSIONS",
+        "max_rss_mb": "PYLSP_MAX_RSS_MB",
+        "max_requests": "PYLSP_MAX_REQUESTS",
+        "max_p95_ms": "PYLSP_MAX_P95_MS",
+        "probe_interval": "PYLSP_PROBE_INTERVAL",
+        "probe_timeout": "PYLSP_PROBE_TIMEOUT",
+        "probe_failures": "PYLSP_PROBE_FAILURES",
+        "drain_timeout": "PYLSP_DRAIN_TIMEOUT",
+        "format_cache_mb": "PYLSP_FORMAT_CACHE_MB",
+        "symbol_index": "PYLSP_SYMBOL_INDEX",
+        "index_path": "PYLSP_INDEX_PATH",
+        "index_rescan_interval": "PYLSP_INDEX_RESCAN_INTERVAL",
+        "trace": "PYLSP_TRACE",
+        "trace_path": "PYLSP_TRACE_PATH",
+        "trace_max_mb": "PYLSP_TRACE_MAX_MB",
+    }
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Build a config from ``PYLSP_*`` environment variables"""
+        config = cls()
+        for name, variable in cls.ENVIRONMENT.items():
+            value = environ.get(variable)
+            if not value:
+                continue
+            default = getattr(config, name)
+            if isinstance(default, bool):
+                # Same rule as entrypoint.sh: anything but an explicit "off" value enables a flag
+                value = value.strip().lower() not in FALSE_VALUES
+            elif isinstance(default, list):
+                value = shlex.split(value)
+            elif not isinstance(default, str):
+                value = type(default)(value)
+            setattr(config, name, value)
+        return config
+
+    @property
+    def probe_uri(self):
+        return f"{self.root_uri.rstrip('/')}/{PROBE_FILENAME}"
+
+    @property
+    def symbol_index_path(self):
+        return self.index_path or os.path.join(uri_to_path(self.root_uri), ".pylsp-index", "symbols.sqlite")
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of ``pid`` and all of its descendants (Linux only)"""
+    children = collections.defaultdict(list)
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces or parentheses; fields resume after the last ")"
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children[ppid].append(int(entry))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class Worker:
+    """One pylsp process spoken to over stdio"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, config):
+        self.config = config
+        self.id = next(Worker._ids)
+        self.process = None
+        self.state = "starting"  # starting -> ready -> draining or exiting -> stopped
+        self.session = None
+        self.on_message = None
+        self.on_exit = None
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.latencies = collections.deque(maxlen=config.latency_window)
+        self.rss = 0
+        self.probe_failures = 0
+        self.last_probe_at = None
+        self.last_probe_ms = None
+        self.recycle_reason = None
+        self._pending = {}
+        self._request_ids = itertools.count(1)
+        self._reader = None
+
+    def __repr__(self):
+        pid = self.process.pid if self.process else None
+        return f"<Worker {self.id} pid={pid} {self.state}>"
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.config.worker_command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        buffer = MessageBuffer()
+        try:
+            while data := await self.process.stdout.read(READ_CHUNK):
+                buffer.feed(data)
+                for message in buffer.messages():
+                    self._dispatch(message)
+        except LspProtocolError as e:
+            log.error("%r sent malformed output: %s", self, e)
+            self.process.kill()
+        finally:
+            await self.process.wait()
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"{self!r} exited"))
+            if self.on_exit is not None:
+                self.on_exit(self)
+
+    def _dispatch(self, message):
+        if "method" not in message and message.get("id") in self._pending:
+            future = self._pending.pop(message["id"])
+            if not future.done():
+                future.set_result(message)
+            return
+        if message.get("method") == "textDocument/publishDiagnostics" \
+                and (message.get("params") or {}).get("uri") == self.config.probe_uri:
+            return
+        if self.on_message is not None:
+            self.on_message(message)
+
+    def send(self, message):
+        if not self.alive or self.process.stdin.is_closing():
+            raise ConnectionError(f"{self!r} is not running")
+        self.process.stdin.write(encode_message(message))
+
+    def notify(self, method, params=None):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+    async def request(self, method, params, timeout):
+        """Send a request of the supervisor's own (ids never clash with the client's)"""
+        request_id = f"supervisor-{self.id}-{next(self._request_ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self.send({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{self!r} did not answer {method} within {timeout}s")
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in response:
+            error = response["error"]
+            raise LspResponseError(error.get("code"), error.get("message"), error.get("data"))
+        return response.get("result")
+
+    def open_probe(self):
+        """(Re)open the probe document; initialize replaces pylsp's workspace"""
+        self.notify("textDocument/didOpen", {
+            "textDocument": {
+                "uri": self.config.probe_uri,
+                "languageId": "python",
+                "version": 1,
+                "text": PROBE_TEXT,
+            }
+        })
+
+    async def warm_up(self):
+        """Initialize with default parameters, then require a passing probe"""
+        await self.request(
+            "initialize",
+            {"processId": os.getpid(), "rootUri": self.config.root_uri, "capabilities": {}},
+            timeout=self.config.start_timeout,
+        )
+        self.notify("initialized", {})
+        self.open_probe()
+        await self.probe(timeout=self.config.start_timeout)
+        self.state = "ready"
+
+    async def probe(self, timeout=None):
+        """Hover over the probe document; a wedged worker won't answer in time"""
+        self.last_probe_at = time.monotonic()
+        result = await self.request(
+            "textDocument/hover",
+            {"textDocument": {"uri": self.config.probe_uri}, "position": PROBE_POSITION},
+            timeout=timeout or self.config.probe_timeout,
+        )
+        self.last_probe_ms = (time.monotonic() - self.last_probe_at) * 1000.0
+        if not result or not result.get("contents"):
+            raise ProbeFailed(f"{self!r} returned an empty hover for the probe document")
+
+    def record_latency(self, seconds):
+        self.requests += 1
+        self.latencies.append(seconds)
+
+    def p95_ms(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, int(len(ordered) * 0.95) - 1)] * 1000.0
+
+    def sample_rss(self):
+        if self.alive:
+            self.rss = process_tree_rss(self.process.pid)
+        return self.rss
+
+    def over_limits(self):
+        """Why this worker should be recycled, or None"""
+        config = self.config
+        if config.max_rss_mb and self.rss > config.max_rss_mb * MB:
+            return f"rss {self.rss / MB:.0f}MB exceeds {config.max_rss_mb}MB"
+        if config.max_requests and self.requests >= config.max_requests:
+            return f"served {self.requests} requests"
+        p95 = self.p95_ms()
+        if config.max_p95_ms and len(self.latencies) >= config.min_latency_samples \
+                and p95 > config.max_p95_ms:
+            return f"p95 latency {p95:.0f}ms exceeds {config.max_p95_ms}ms"
+        if config.probe_failures and self.probe_failures >= config.probe_failures:
+            return f"{self.probe_failures} consecutive failed readiness probes"
+        return None
+
+    async def stop(self, timeout=5):
+        """Ask pylsp to shut down, killing it if it does not exit in time"""
+        self.state = "stopped"
+        if self.alive:
+            try:
+                await self.request("shutdown", None, timeout=timeout)
+                self.notify("exit", None)
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except (TimeoutError, ConnectionError, LspResponseError, asyncio.TimeoutError):
+                if self.alive:
+                    self.process.kill()
+        if self.process is not None:
+            await self.process.wait()
+        if self._reader is not None:
+            await self._reader
+
+    def status(self):
+        p95 = self.p95_ms()
+        return {
+            "id": self.id,
+            "pid": self.process.pid if self.process else None,
+            "state": self.state,
+            "has_session": self.session is not None,
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "rss_mb": round(self.rss / MB, 1),
+            "requests": self.requests,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "probe_failures": self.probe_failures,
+            "last_probe_ms": round(self.last_probe_ms, 1) if self.last_probe_ms is not None else None,
+            "recycle_reason": self.recycle_reason,
+        }
+
+
+class Session:
+    """One editor connection, relayed to whichever worker currently serves it"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, supervisor, reader, writer):
+        self.id = next(Session._ids)
+        self.supervisor = supervisor
+        self.reader = reader
+        self.writer = writer
+        self.worker = None
+        self.documents = DocumentStore()
+        self.initialize_params = None
+        self.initialized = False
+        self.configuration = None
+        self.in_flight = {}
+        self.server_requests = set()
+        self.formatting = {}
+        self.traces = {}
+        self.backlog = None
+        self.holds = 0
+        self.index_misses = set()
+        self.closed = False
+
+    async def run(self, worker):
+        self.attach(worker)
+        buffer = MessageBuffer()
+        try:
+            while data := await self.reader.read(READ_CHUNK):
+                buffer.feed(data)
+                for message in buffer.messages():
+                    self.from_client(message)
+        except (LspProtocolError, ConnectionError) as e:
+            log.warning("Dropping client connection: %s", e)
+
+    def attach(self, worker):
+        worker.session = self
+        worker.on_message = self.from_worker
+        self.worker = worker
+
+    def from_client(self, message):
+        if "method" not in message:
+            # A reply to a server-to-client request; only the worker that asked may get it
+            if message.get("id") in self.server_requests:
+                self.server_requests.discard(message["id"])
+                try:
+                    self.worker.send(message)
+                except ConnectionError:
+                    # The worker that asked is gone; its replacement never made this request
+                    pass
+            return
+        if self.supervisor.tracer is not None and "id" in message:
+            self.traces[message["id"]] = self.supervisor.tracer.begin(self.id, message["id"], message["method"])
+        if self.backlog is not None:
+            self.backlog.append(message)
+            return
+        self.forward(message)
+
+    @property
+    def root_path(self):
+        params = self.initialize_params or {}
+        return uri_to_path(params.get("rootUri")) or params.get("rootPath") \
+            or uri_to_path(self.supervisor.config.root_uri)
+
+    def format_from_cache(self, message):
+        """Answer a formatting request from the cache; on a miss, remember what to store"""
+        cache = self.supervisor.format_cache
+        params = message.get("params") or {}
+        document = self.documents.get((params.get("textDocument") or {}).get("uri"))
+        if cache is None or document is None:
+            return False
+        options = params.get("options")
+        settings = {
+            "initializationOptions": (self.initialize_params or {}).get("initializationOptions"),
+            "configuration": self.configuration,
+        }
+        fingerprint = cache.fingerprint(self.root_path, settings, uri_to_path(document.uri))
+        edits = cache.get(document.text, options, fingerprint)
+        if edits is not None:
+            self.send({"jsonrpc": "2.0", "id": message["id"], "result": edits})
+            return True
+        self.formatting[message["id"]] = (document.text, options, fingerprint)
+        return False
+
+    def hold(self):
+        """Queue client messages instead of forwarding them until ``release``"""
+        if self.backlog is None:
+            self.backlog = []
+        self.holds += 1
+
+    def release(self):
+        self.holds -= 1
+        if self.holds > 0:
+            return
+        backlog, self.backlog = self.backlog, None
+        for position, message in enumerate(backlog):
+            if self.backlog is not None:
+                # Forwarding held the session again (or found the worker dead); keep the order
+                self.backlog.extend(backlog[position:])
+                break
+            self.forward(message)
+
+    def answer_from_index(self, message):
+        """Serve workspace symbols, and references to workspace modules' top-level names, from the symbol index"""
+        index = self.supervisor.symbol_index
+        if index is None:
+            return False
+        params = message.get("params") or {}
+        if message["method"] == "workspace/symbol":
+            self.supervisor._spawn_task(self.reply(message["id"], index.search(params.get("query", ""))))
+            return True
+        if message["id"] in self.index_misses:
+            self.index_misses.discard(message["id"])
+            return False
+        document = self.documents.get((params.get("textDocument") or {}).get("uri"))
+        if document is None or not index.contains(uri_to_path(document.uri)):
+            return False
+        # Later messages wait until we know whether the worker has to answer this one
+        self.hold()
+        self.supervisor._spawn_task(self.references_from_index(message, uri_to_path(document.uri)))
+        return True
+
+    async def references_from_index(self, message, path):
+        index = self.supervisor.symbol_index
+        params = message.get("params") or {}
+        try:
+            definition = await index.definition_at(path, params.get("position") or {"line": 0, "character": 0})
+        except Exception:
+            log.exception("Symbol index query failed")
+            definition = None
+        # Locals, class members, most attributes and names from outside the workspace need Jedi's inference
+        if definition is None:
+            self.index_misses.add(message["id"])
+            self.backlog.insert(0, message)
+            self.release()
+            return
+        self.release()
+        include_declaration = (params.get("context") or {}).get("includeDeclaration", True)
+        await self.reply(message["id"], index.references(definition, include_declaration))
+
+    async def reply(self, request_id, result):
+        try:
+            result = await result
+        except Exception as e:
+            log.exception("Symbol index query failed")
+            self.send({"jsonrpc": "2.0", "id": request_id, "error": {"code": INTERNAL_ERROR, "message": str(e)}})
+        else:
+            self.send({"jsonrpc": "2.0", "id": request_id, "result": result})
+
+    def update_index(self, message, document):
+        """Keep the symbol index in step with open buffers and files changed on disk"""
+        index = self.supervisor.symbol_index
+        method = message["method"]
+        if index is None:
+            return
+        if method == "workspace/didChangeWatchedFiles":
+            for change in (message.get("params") or {}).get("changes", []):
+                index.file_changed(uri_to_path(change.get("uri")))
+        elif document is None:
+            return
+        elif method == "textDocument/didOpen":
+            index.buffer_opened(uri_to_path(document.uri), document.text)
+        elif method == "textDocument/didChange":
+            index.buffer_changed(uri_to_path(document.uri), document.text)
+        elif method == "textDocument/didClose":
+            index.buffer_closed(uri_to_path(document.uri))
+
+    def close_documents(self):
+        """The client went away; its buffers no longer override the files on disk"""
+        if self.supervisor.symbol_index is not None:
+            for document in self.documents:
+                self.supervisor.symbol_index.buffer_closed(uri_to_path(document.uri))
+        self.documents = DocumentStore()
+
+    def forward(self, message):
+        method = message["method"]
+        if method == "textDocument/formatting" and "id" in message and self.format_from_cache(message):
+            return
+        if method in ("workspace/symbol", "textDocument/references") and "id" in message \
+                and self.answer_from_index(message):
+            return
+        if "id" in message:
+            self.in_flight[message["id"]] = (method, time.monotonic())
+            if method == "initialize":
+                self.initialize_params = message.get("params") or {}
+        elif method == "initialized":
+            self.initialized = True
+        elif method == "exit":
+            # pylsp exits on its own now; that is the end of the session, not a crash
+            self.worker.state = "exiting"
+        elif method == "workspace/didChangeConfiguration":
+            self.configuration = message.get("params")
+        else:
+            self.update_index(message, self.documents.observe(message))
+        trace = self.traces.get(message.get("id"))
+        if trace is not None:
+            trace.forwarded = time.time()
+            trace.worker_pid = self.worker.process.pid if self.worker.process else None
+        try:
+            self.worker.send(message)
+        except ConnectionError:
+            # The worker died; its exit handler is already moving us to a new one
+            self.in_flight.pop(message.get("id"), None)
+            if self.backlog is None:
+                self.backlog = []
+            self.backlog.append(message)
+
+    def from_worker(self, message):
+        # Instrumented workers attach timings; they are for the tracer, never the client
+        timing = message.pop(TIMING_FIELD, None)
+        tracer = self.supervisor.tracer
+        if message.get("method") == TIMING_NOTIFICATION:
+            if tracer is not None:
+                params = message.get("params") or {}
+                tracer.worker_activity(params.get("method"), params.get("timing"), self.worker.process.pid)
+            return
+        if timing is not None and tracer is not None and "method" in message:
+            tracer.worker_activity(message["method"], timing, self.worker.process.pid)
+        if "method" not in message:
+            trace = self.traces.get(message.get("id"))
+            if trace is not None:
+                trace.worker = timing
+                trace.replied = time.time()
+            request = self.in_flight.pop(message.get("id"), None)
+            if request is not None:
+                method, started = request
+                self.worker.record_latency(time.monotonic() - started)
+                if method == "shutdown" and "error" not in message:
+                    self.worker.state = "exiting"
+                if method == "initialize":
+                    self.worker.open_probe()
+                    if self.supervisor.symbol_index is not None and isinstance(message.get("result"), dict):
+                        message["result"].setdefault("capabilities", {})["workspaceSymbolProvider"] = True
+            pending_format = self.formatting.pop(message.get("id"), None)
+            if pending_format is not None and isinstance(message.get("result"), list):
+                self.supervisor.format_cache.store(*pending_format, message["result"])
+        elif "id" in message:
+            self.server_requests.add(message["id"])
+        self.send(message)
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(encode_message(message))
+        if self.traces and "method" not in message:
+            trace = self.traces.pop(message.get("id"), None)
+            if trace is not None:
+                self.supervisor.tracer.finish(trace, message)
+
+    async def handover(self, worker, drain=True):
+        """Move this session onto ``worker`` without the client reconnecting"""
+        self.hold()
+        if drain:
+            deadline = time.monotonic() + self.supervisor.config.drain_timeout
+            while self.in_flight and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        # Whatever is still outstanding will never be answered; let the client retry
+        for request_id, (method, _) in self.in_flight.items():
+            self.send({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {"code": CONTENT_MODIFIED, "message": f"{method} interrupted by a language server restart"},
+            })
+        self.in_flight.clear()
+        self.formatting.clear()
+        self.server_requests.clear()
+
+        previous = self.worker
+        previous.on_message = None
+        previous.session = None
+        try:
+            if self.initialize_params is not None:
+                await worker.request("initialize", self.initialize_params, timeout=self.supervisor.config.start_timeout)
+                if self.initialized:
+                    worker.notify("initialized", {})
+                if self.configuration is not None:
+                    worker.notify("workspace/didChangeConfiguration", self.configuration)
+                worker.open_probe()
+                for document in self.documents:
+                    worker.notify("textDocument/didOpen", {"textDocument": document.to_item()})
+        finally:
+            self.attach(worker)
+            self.release()
+        log.info("Session moved from %r to %r with %d open document(s)",
+                 previous, worker, len(self.documents.documents))
+
+
+class Supervisor:
+    """Accepts editor sessions on the LSP port and manages the pylsp workers"""
+
+    def __init__(self, config):
+        self.config = config
+        self.workers = set()
+        self.spares = []
+        self.sessions = set()
+        self.recycled = 0
+        self.format_cache = FormatCache(int(config.format_cache_mb * MB)) if config.format_cache_mb > 0 else None
+        self.symbol_index = None
+        self.tracer = Tracer(config.trace_path, int(config.trace_max_mb * MB)) if config.trace else None
+        self.port = None
+        self.health_port = None
+        self._spawning = 0
+        self._last_spawn_error = None
+        self._slots = None
+        self._tasks = set()
+        self._servers = []
+        self._stopping = None
+
+    def _spawn_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @property
+    def ready(self):
+        if self.spares:
+            return True
+        if self.config.spare_workers:
+            return False
+        return self._last_spawn_error is None
+
+    async def spawn_worker(self):
+        """Start, initialize and probe a new worker"""
+        worker = Worker(self.config)
+        worker.on_exit = self._worker_exited
+        self.workers.add(worker)
+        try:
+            await worker.start()
+            await worker.warm_up()
+        except Exception as e:
+            self._last_spawn_error = str(e)
+            self.workers.discard(worker)
+            await worker.stop()
+            raise
+        self._last_spawn_error = None
+        log.info("Started %r", worker)
+        return worker
+
+    async def acquire_worker(self):
+        """Take a warm spare if there is one, otherwise start a worker now"""
+        while self.spares:
+            worker = self.spares.pop(0)
+            if worker.alive and worker.state == "ready":
+                break
+        else:
+            worker = await self.spawn_worker()
+        self.replenish()
+        return worker
+
+    def replenish(self):
+        """Start enough workers in the background to restore the spare pool"""
+        for _ in range(self.config.spare_workers - len(self.spares) - self._spawning):
+            self._spawn_task(self._add_spare())
+
+    async def _add_spare(self):
+        self._spawning += 1
+        try:
+            worker = await self.spawn_worker()
+        except Exception as e:
+            log.error("Could not start a spare worker: %s", e)
+            return
+        finally:
+            self._spawning -= 1
+        self.spares.append(worker)
+
+    async def retire(self, worker):
+        if worker in self.spares:
+            self.spares.remove(worker)
+        await worker.stop()
+        self.workers.discard(worker)
+
+    async def recycle(self, worker, reason, drain=True):
+        """Replace ``worker``, handing its session (if any) to a fresh one"""
+        if worker.state in ("draining", "stopped"):
+            return
+        log.warning("Recycling %r: %s", worker, reason)
+        worker.state = "draining"
+        worker.recycle_reason = reason
+        session = worker.session
+        if session is not None:
+            try:
+                replacement = await self.acquire_worker()
+            except Exception as e:
+                log.error("No replacement for %r, keeping it: %s", worker, e)
+                if worker.alive:
+                    worker.state = "ready"
+                    worker.probe_failures = 0
+                    return
+                session.writer.close()
+            else:
+                await session.handover(replacement, drain=drain)
+                if session.closed:
+                    # The client left mid-handover and its cleanup retired the old worker, not this one
+                    replacement.on_message = None
+                    replacement.session = None
+                    await self.retire(replacement)
+        self.recycled += 1
+        await self.retire(worker)
+        self.replenish()
+
+    def _worker_exited(self, worker):
+        if worker.state == "exiting":
+            # The client shut the worker down; hang up like pylsp's own server would
+            if worker.session is not None:
+                worker.session.writer.close()
+            return
+        if worker.state in ("draining", "stopped"):
+            return
+        self._spawn_task(self.recycle(worker, f"exited with code {worker.process.returncode}", drain=False))
+
+    async def _probe(self, worker):
+        try:
+            await worker.probe()
+        except (TimeoutError, ConnectionError, LspResponseError, ProbeFailed) as e:
+            worker.probe_failures += 1
+            log.warning("Readiness probe of %r failed (%d): %s", worker, worker.probe_failures, e)
+        else:
+            worker.probe_failures = 0
+
+    async def check_workers(self):
+        """Sample memory, probe when due and recycle workers over their limits"""
+        now = time.monotonic()
+        probes = []
+        for worker in list(self.workers):
+            if worker.state != "ready":
+                continue
+            worker.sample_rss()
+            if worker.last_probe_at is None or now - worker.last_probe_at >= self.config.probe_interval:
+                probes.append(self._probe(worker))
+        await asyncio.gather(*probes)
+        for worker in list(self.workers):
+            if worker.state != "ready":
+                continue
+            reason = worker.over_limits()
+            if reason is not None:
+                self._spawn_task(self.recycle(worker, reason))
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.config.monitor_interval)
+            try:
+                await self.check_workers()
+            except Exception:
+                log.exception("Worker check failed")
+
+    async def handle_client(self, reader, writer):
+        async with self._slots:
+            session = Session(self, reader, writer)
+            try:
+                worker = await self.acquire_worker()
+            except Exception as e:
+                log.error("Could not start a worker for a new session: %s", e)
+                writer.close()
+                return
+            self.sessions.add(session)
+            try:
+                await session.run(worker)
+            finally:
+                session.closed = True
+                self.sessions.discard(session)
+                writer.close()
+                session.close_documents()
+                session.worker.on_message = None
+                session.worker.session = None
+                await self.retire(session.worker)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "sessions": len(self.sessions),
+            "spares": len(self.spares),
+            "recycled": self.recycled,
+            "format_cache": self.format_cache.stats() if self.format_cache is not None else None,
+            "symbol_index": self.symbol_index.stats() if self.symbol_index is not None else None,
+            "last_spawn_error": self._last_spawn_error,
+            "workers": sorted((worker.status() for worker in self.workers), key=lambda w: w["id"]),
+        }
+
+    def metrics(self):
+        """Prometheus text exposition of the supervisor's state and, when tracing, request timings"""
+        workers = sorted(self.workers, key=lambda worker: worker.id)
+        lines = []
+        lines += metric_lines("pylsp_sessions", "gauge", "Connected editor sessions.", [({}, len(self.sessions))])
+        lines += metric_lines("pylsp_spare_workers", "gauge", "Warm workers waiting for a session.",
+                              [({}, len(self.spares))])
+        lines += metric_lines("pylsp_workers_recycled_total", "counter", "Workers replaced by the supervisor.",
+                              [({}, self.recycled)])
+        lines += metric_lines("pylsp_worker_rss_bytes", "gauge", "Resident memory of a worker and its children.",
+                              [({"worker": worker.id}, worker.rss) for worker in workers])
+        lines += metric_lines("pylsp_worker_requests_total", "counter", "Requests served by a worker.",
+                              [({"worker": worker.id}, worker.requests) for worker in workers])
+        if self.format_cache is not None:
+            stats = self.format_cache.stats()
+            lines += metric_lines("pylsp_format_cache_lookups_total", "counter", "Formatting cache lookups.",
+                                  [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])])
+        if self.tracer is not None:
+            lines += self.tracer.render()
+        return "\n".join(lines) + "\n"
+
+    async def handle_http(self, reader, writer):
+        """Tiny HTTP endpoint for container health checks"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+        except (asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+        content_type = "text/plain; charset=utf-8"
+        if path == "/healthz":
+            status, body = 200, "ok\n"
+        elif path == "/readyz":
+            status, body = (200, "ready\n") if self.ready else (503, "not ready\n")
+        elif path == "/status":
+            status, body = 200, json.dumps(self.status(), indent=2) + "\n"
+            content_type = "application/json"
+        elif path == "/metrics":
+            status, body = 200, self.metrics()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body = 404, "not found\n"
+        payload = body.encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+        writer.write(
+            f"HTTP/1.0 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start_symbol_index(self):
+        index = SymbolIndex(self.config.symbol_index_path, uri_to_path(self.config.root_uri))
+        try:
+            await index.open()
+        except (OSError, sqlite3.Error) as e:
+            log.error("Symbol index disabled, %s is unusable: %s", index.db_path, e)
+            await index.close()
+            return
+        self.symbol_index = index
+        self._spawn_task(index.run(self.config.index_rescan_interval))
+
+    async def start(self):
+        """Start the spare pool, the LSP and health listeners and the monitor"""
+        self._slots = asyncio.Semaphore(self.config.max_sessions)
+        self._stopping = asyncio.Event()
+        self.replenish()
+        if self.config.symbol_index:
+            await self.start_symbol_index()
+        lsp_server = await asyncio.start_server(self.handle_client, self.config.host, self.config.port)
+        health_server = await asyncio.start_server(self.handle_http, self.config.host, self.config.health_port)
+        self._servers = [lsp_server, health_server]
+        self.port = lsp_server.sockets[0].getsockname()[1]
+        self.health_port = health_server.sockets[0].getsockname()[1]
+        self._spawn_task(self._monitor())
+        log.info("Supervisor listening on %s:%d (health on port %d)",
+                 self.config.host, self.port, self.health_port)
+
+    async def stop(self):
+        """Stop accepting sessions and shut every worker down"""
+        for server in self._servers:
+            server.close()
+        tasks = [task for task in self._tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in list(self.sessions):
+            session.writer.close()
+        for worker in list(self.workers):
+            worker.state = "stopped"
+        await asyncio.gather(*(self.retire(worker) for worker in list(self.workers)))
+        if self.symbol_index is not None:
+            await self.symbol_index.close()
+            self.symbol_index = None
+        if self.tracer is not None:
+            self.tracer.close()
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def serve_forever(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: self._spawn_task(self.stop()))
+        await self._stopping.wait()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    asyncio.run(Supervisor(SupervisorConfig.from_env()).serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,752 @@
+"""Persistent project-wide symbol index for ``workspace/symbol`` and references.
+
+pylsp answers symbol and reference queries by having Jedi analyse files on
+demand, which gets slower as the workspace grows. This index parses every
+Python file under the workspace root once with ``ast`` and keeps, in an
+on-disk SQLite database:
+
+- definitions: classes, functions and methods, plus module- and class-level
+  assignments, each with its kind, container and position;
+- references: every identifier occurrence (names, attribute names, imported
+  names), flagged when it is the defining occurrence;
+- imports: which modules and names each file imports.
+
+The database survives restarts; a start-up scan only re-parses files whose
+mtime or size changed. After that the index is kept current incrementally:
+from open editor buffers (debounced; saving an open buffer changes nothing
+the index has not already seen), from watched-file notifications, and from
+a periodic rescan. Symbols can be looked up by
+case-insensitive name prefix (served from an index) or by fuzzy subsequence
+match. All database work runs on one background thread so the event loop
+never blocks on it.
+
+Every occurrence records what it resolves to: a module-level name, a name
+bound in an enclosing function (or lambda/comprehension), a class body name,
+a name imported from another module or an attribute (with the dotted name
+it is looked up on, such as ``utils`` in ``utils.helper``). References are
+answered for top-level definitions of workspace modules only. Occurrences
+are resolved through the indexed imports, following ``from m import name``
+(aliases and re-exports included), ``from m import *`` and ``m.name`` after
+``import m``, so a same-named definition in another module is not a
+reference. Names that do not resolve to a workspace definition, locals,
+class members and attributes of anything but a module need type inference
+and are left to Jedi.
+"""
+import ast
+import asyncio
+import collections
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+log = logging.getLogger("lsp_symbol_index")
+
+SCHEMA_VERSION = 3
+MAX_FILE_BYTES = 2 * 1024 * 1024
+SKIP_DIRECTORIES = {"__pycache__", "node_modules", "site-packages", "venv"}
+BATCH_SIZE = 200
+FUZZY_CANDIDATES = 5000
+
+# LSP SymbolKind values
+KIND_CLASS = 5
+KIND_METHOD = 6
+KIND_FIELD = 8
+KIND_FUNCTION = 12
+KIND_VARIABLE = 13
+KIND_CONSTANT = 14
+
+# What an occurrence of a name resolves to
+SCOPE_MODULE = 0  # a module-level name (or a builtin), also when used inside functions
+SCOPE_LOCAL = 1  # a name bound in an enclosing function, lambda or comprehension
+SCOPE_ATTRIBUTE = 2  # obj.name, which cannot be resolved without type inference
+SCOPE_CLASS = 3  # a name bound directly in a class body
+SCOPE_IMPORT = 4  # the name in "from module import name"
+MAX_IMPORT_DEPTH = 10  # re-exports followed before giving up (and breaking import cycles)
+
+SCHEMA = """
+CREATE TABLE files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE symbols (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    kind INTEGER NOT NULL,
+    container TEXT,
+    line INTEGER NOT NULL,
+    character INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    end_character INTEGER NOT NULL
+);
+CREATE INDEX symbols_name_lower ON symbols (name_lower);
+CREATE INDEX symbols_path ON symbols (path);
+CREATE TABLE refs (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    character INTEGER NOT NULL,
+    end_character INTEGER NOT NULL,
+    is_definition INTEGER NOT NULL,
+    scope INTEGER NOT NULL,
+    qualifier TEXT
+);
+CREATE INDEX refs_name ON refs (name, scope);
+CREATE INDEX refs_path ON refs (path);
+CREATE TABLE imports (
+    path TEXT NOT NULL,
+    module TEXT NOT NULL,
+    name TEXT,
+    alias TEXT,
+    line INTEGER NOT NULL
+);
+CREATE INDEX imports_path ON imports (path);
+CREATE INDEX imports_module ON imports (module);
+"""
+
+
+def _utf16_column(line, byte_offset):
+    """Convert an ast (UTF-8 byte) column into an LSP (UTF-16) column"""
+    if line.isascii():
+        return byte_offset
+    prefix = line.encode("utf-8")[:byte_offset].decode("utf-8", errors="replace")
+    return len(prefix.encode("utf-16-le")) // 2
+
+
+def _bound_names(node):
+    """Names a function, lambda, comprehension or class body binds in its own scope"""
+    names = set()
+    declared_global = set()
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+        arguments = node.args
+        for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+            if arg is not None:
+                names.add(arg.arg)
+        stack = list(node.body) if isinstance(node.body, list) else [node.body]
+    elif isinstance(node, ast.ClassDef):
+        stack = list(node.body)
+    else:
+        stack = [generator.target for generator in node.generators]
+    while stack:
+        child = stack.pop()
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(child.name)
+            continue
+        if isinstance(child, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            continue
+        if isinstance(child, ast.Name) and isinstance(child.ctx, (ast.Store, ast.Del)):
+            names.add(child.id)
+        elif isinstance(child, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in child.names if alias.name != "*")
+        elif isinstance(child, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and child.name:
+            names.add(child.name)
+        elif isinstance(child, ast.MatchMapping) and child.rest:
+            names.add(child.rest)
+        elif isinstance(child, ast.Global):
+            declared_global.update(child.names)
+        stack.extend(ast.iter_child_nodes(child))
+    return names - declared_global
+
+
+class _Collector(ast.NodeVisitor):
+    """Walks one module and collects definitions, references and imports"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.symbols = []
+        self.refs = []
+        self.imports = []
+        # (kind, qualified name, names bound in it) of the enclosing classes and function-like scopes
+        self._scopes = []
+
+    def _column(self, lineno, byte_offset):
+        line = self.lines[lineno - 1] if 0 < lineno <= len(self.lines) else ""
+        return _utf16_column(line, byte_offset)
+
+    def _reference(self, name, lineno, byte_offset, scope, is_definition=False, qualifier=None):
+        start = self._column(lineno, byte_offset)
+        end = self._column(lineno, byte_offset + len(name.encode("utf-8")))
+        self.refs.append((name, lineno - 1, start, end, int(is_definition), scope, qualifier))
+        return start, end
+
+    def _qualifier(self, node):
+        """Dotted name of a module-level name or attribute chain (``os.path``), else None"""
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name) or self._scope_of(node.id) != SCOPE_MODULE:
+            return None
+        parts.append(node.id)
+        return ".".join(reversed(parts))
+
+    def _name_offset(self, node, keyword):
+        """Byte offset of a def/class name, which ast does not record"""
+        line = self.lines[node.lineno - 1].encode("utf-8") if node.lineno <= len(self.lines) else b""
+        index = line.find(node.name.encode("utf-8"), node.col_offset + len(keyword))
+        return index if index != -1 else node.col_offset
+
+    @property
+    def _container(self):
+        return self._scopes[-1][1] if self._scopes else None
+
+    @property
+    def _in_function(self):
+        return any(kind == "function" for kind, _, _ in self._scopes)
+
+    def _scope_of(self, name):
+        """Which scope an occurrence of ``name`` at the current point resolves to"""
+        if self._scopes and self._scopes[-1][0] == "class" and name in self._scopes[-1][2]:
+            return SCOPE_LOCAL if self._in_function else SCOPE_CLASS
+        if any(kind == "function" and name in bound for kind, _, bound in self._scopes):
+            return SCOPE_LOCAL
+        return SCOPE_MODULE
+
+    def _define(self, name, kind, lineno, byte_offset):
+        scope = SCOPE_CLASS if self._scopes else SCOPE_MODULE
+        start, end = self._reference(name, lineno, byte_offset, scope, is_definition=True)
+        self.symbols.append((name, kind, self._container, lineno - 1, start, lineno - 1, end))
+
+    def _visit_scope(self, node, kind, name=None):
+        qualified = f"{self._container}.{name}" if self._container and name else (name or self._container)
+        self._scopes.append((kind, qualified, _bound_names(node)))
+        for child in ast.iter_child_nodes(node):
+            if child not in getattr(node, "decorator_list", ()):
+                self.visit(child)
+        self._scopes.pop()
+
+    def _visit_definition(self, node, keyword, kind, scope):
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        offset = self._name_offset(node, keyword)
+        if not self._in_function:
+            self._define(node.name, kind, node.lineno, offset)
+        else:
+            self._reference(node.name, node.lineno, offset, SCOPE_LOCAL, is_definition=True)
+        self._visit_scope(node, scope, node.name)
+
+    def visit_ClassDef(self, node):
+        self._visit_definition(node, "class", KIND_CLASS, "class")
+
+    def visit_FunctionDef(self, node):
+        in_class = bool(self._scopes) and self._scopes[-1][0] == "class"
+        keyword = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+        self._visit_definition(node, keyword, KIND_METHOD if in_class else KIND_FUNCTION, "function")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_scope(node, "function")
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_Lambda
+
+    def _visit_target(self, target):
+        if isinstance(target, ast.Name) and not self._in_function:
+            if self._scopes:
+                kind = KIND_FIELD
+            else:
+                kind = KIND_CONSTANT if target.id.isupper() else KIND_VARIABLE
+            self._define(target.id, kind, target.lineno, target.col_offset)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self._visit_target(element)
+        elif isinstance(target, ast.Starred):
+            self._visit_target(target.value)
+        else:
+            self.visit(target)
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            self._visit_target(target)
+        self.visit(node.value)
+
+    def visit_AnnAssign(self, node):
+        self._visit_target(node.target)
+        self.visit(node.annotation)
+        if node.value is not None:
+            self.visit(node.value)
+
+    def visit_Name(self, node):
+        is_binding = isinstance(node.ctx, ast.Store)
+        self._reference(node.id, node.lineno, node.col_offset, self._scope_of(node.id), is_binding)
+
+    def visit_Attribute(self, node):
+        self.visit(node.value)
+        if node.end_lineno is not None and node.end_col_offset is not None:
+            offset = node.end_col_offset - len(node.attr.encode("utf-8"))
+            self._reference(node.attr, node.end_lineno, offset, SCOPE_ATTRIBUTE, qualifier=self._qualifier(node.value))
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append((alias.name, None, alias.asname, node.lineno - 1))
+
+    def visit_ImportFrom(self, node):
+        module = "." * node.level + (node.module or "")
+        for alias in node.names:
+            self.imports.append((module, alias.name, alias.asname, node.lineno - 1))
+            # An imported name is a use of the other module's top-level name
+            if alias.name != "*":
+                self._reference(alias.name, alias.lineno, alias.col_offset, SCOPE_IMPORT, qualifier=module)
+
+
+def extract(text):
+    """Parse Python source into (symbols, refs, imports); raises SyntaxError"""
+    tree = ast.parse(text)
+    collector = _Collector(text.splitlines())
+    collector.visit(tree)
+    return collector.symbols, collector.refs, collector.imports
+
+
+def fuzzy_rank(query, name):
+    """Sort key for ``name`` as a match for ``query``, or None if it does not match"""
+    query, lowered = query.lower(), name.lower()
+    if lowered == query:
+        tier = 0
+    elif lowered.startswith(query):
+        tier = 1
+    elif query in lowered:
+        tier = 2
+    else:
+        position = 0
+        for char in query:
+            position = lowered.find(char, position) + 1
+            if position == 0:
+                return None
+        tier = 3
+    return (tier, len(name), name)
+
+
+class SymbolIndex:
+    """SQLite-backed symbol index for one workspace root"""
+
+    def __init__(self, db_path, root_path):
+        self.db_path = db_path
+        self.root_path = os.path.abspath(root_path)
+        self.definition_names = collections.Counter()
+        self.last_scan = None
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="symbol-index")
+        self._open_buffers = collections.Counter()
+        self._debounced = {}
+        self._unparsed = set()
+
+    # The methods below starting with "_" run on the index thread only
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            for table in ("files", "symbols", "refs", "imports"):
+                self._db.execute(f"DROP TABLE IF EXISTS {table}")
+            self._db.executescript(SCHEMA)
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            self._db.commit()
+        self.definition_names = collections.Counter(
+            name for (name,) in self._db.execute("SELECT name FROM symbols WHERE container IS NULL")
+        )
+
+    def _forget(self, path):
+        for (name,) in self._db.execute("SELECT name FROM symbols WHERE path = ? AND container IS NULL", (path,)):
+            self.definition_names[name] -= 1
+            if self.definition_names[name] <= 0:
+                del self.definition_names[name]
+        for table in ("symbols", "refs", "imports"):
+            self._db.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+    def _store(self, path, text, mtime_ns, size):
+        """Replace the entries of ``path``; a file that does not parse keeps its old entries"""
+        try:
+            symbols, refs, imports = extract(text)
+        except (SyntaxError, ValueError):
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, mtime_ns, size))
+            self._unparsed.add(path)
+            return False
+        self._unparsed.discard(path)
+        self._forget(path)
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, mtime_ns, size))
+        self._db.executemany(
+            "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(path, name, name.lower(), *rest) for name, *rest in symbols],
+        )
+        self._db.executemany("INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [(path, *ref) for ref in refs])
+        self._db.executemany("INSERT INTO imports VALUES (?, ?, ?, ?, ?)", [(path, *imp) for imp in imports])
+        self.definition_names.update(name for name, _, container, *_ in symbols if container is None)
+        return True
+
+    def _index_text(self, path, text):
+        self._store(path, text, -1, len(text))
+        self._db.commit()
+
+    def _index_from_disk(self, path):
+        try:
+            stat = os.stat(path)
+            if stat.st_size > MAX_FILE_BYTES:
+                raise OSError("too large")
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            self._forget(path)
+            self._unparsed.discard(path)
+            self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+        else:
+            self._store(path, text, stat.st_mtime_ns, stat.st_size)
+        self._db.commit()
+
+    def _walk(self):
+        stack = [self.root_path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name in SKIP_DIRECTORIES:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith((".py", ".pyi")) and entry.is_file(follow_symlinks=False):
+                    yield entry
+
+    def _scan(self):
+        """Re-parse files that changed on disk since they were indexed and drop deleted ones"""
+        started = time.monotonic()
+        known = {path: (mtime, size) for path, mtime, size in self._db.execute("SELECT * FROM files")}
+        files = indexed = 0
+        for entry in self._walk():
+            files += 1
+            known_signature = known.pop(entry.path, None)
+            if entry.path in self._open_buffers:
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if known_signature == (stat.st_mtime_ns, stat.st_size) or stat.st_size > MAX_FILE_BYTES:
+                continue
+            try:
+                with open(entry.path, encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            except OSError:
+                continue
+            self._store(entry.path, text, stat.st_mtime_ns, stat.st_size)
+            indexed += 1
+            if indexed % BATCH_SIZE == 0:
+                self._db.commit()
+        for path in known:
+            if path not in self._open_buffers:
+                self._forget(path)
+                self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self._db.commit()
+        self.last_scan = {
+            "files": files,
+            "indexed": indexed,
+            "removed": len(known),
+            "duration_ms": round((time.monotonic() - started) * 1000.0, 1),
+        }
+        return self.last_scan
+
+    def _search(self, query, limit):
+        columns = "name, kind, container, path, line, character, end_line, end_character"
+        lowered = query.lower()
+        # Prefix matches come straight off the name index
+        rows = self._db.execute(
+            f"SELECT {columns} FROM symbols WHERE name_lower >= ? AND name_lower < ? LIMIT ?",
+            (lowered, lowered + "\U0010ffff", limit),
+        ).fetchall()
+        if len(rows) < limit and lowered:
+            pattern = "%" + "%".join(
+                char.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") for char in lowered
+            ) + "%"
+            rows += self._db.execute(
+                f"SELECT {columns} FROM symbols WHERE name_lower LIKE ? ESCAPE '\\' "
+                f"AND NOT (name_lower >= ? AND name_lower < ?) LIMIT ?",
+                (pattern, lowered, lowered + "\U0010ffff", FUZZY_CANDIDATES),
+            ).fetchall()
+        ranked = sorted(
+            (rank, row) for row in rows if (rank := fuzzy_rank(query, row[0])) is not None
+        )
+        return [row for _, row in ranked[:limit]]
+
+    def _import_roots(self, cache):
+        """Directories absolute imports start from: the workspace root and the parents of top-level packages"""
+        if "roots" not in cache:
+            packages = {os.path.dirname(path) for (path,) in self._db.execute(
+                "SELECT path FROM files WHERE path LIKE '%__init__.py' OR path LIKE '%__init__.pyi'"
+            )}
+            roots = {os.path.dirname(package) for package in packages if os.path.dirname(package) not in packages}
+            cache["roots"] = [self.root_path] + sorted(roots - {self.root_path})
+        return cache["roots"]
+
+    def _module_path(self, module, importer, cache):
+        """The workspace file ``module`` (as written in ``importer``) refers to, or None"""
+        key = ("module", module, os.path.dirname(importer))
+        if key not in cache:
+            level = len(module) - len(module.lstrip("."))
+            parts = [part for part in module[level:].split(".") if part]
+            if level:
+                base = os.path.dirname(importer)
+                for _ in range(level - 1):
+                    base = os.path.dirname(base)
+                bases = [base]
+            else:
+                bases = self._import_roots(cache)
+            cache[key] = None
+            for base in bases:
+                stem = os.path.join(base, *parts)
+                candidates = [stem + ".py", stem + ".pyi", os.path.join(stem, "__init__.py"),
+                              os.path.join(stem, "__init__.pyi")]
+                row = self._db.execute(
+                    "SELECT path FROM files WHERE path IN (?, ?, ?, ?) ORDER BY path LIMIT 1", candidates
+                ).fetchone()
+                if row is not None:
+                    cache[key] = row[0]
+                    break
+        return cache[key]
+
+    def _bindings(self, path, cache):
+        """(defined names, {name: (module, imported name or None for a module)}, star-imported modules)"""
+        key = ("bindings", path)
+        if key not in cache:
+            defined = {name for (name,) in self._db.execute(
+                "SELECT name FROM symbols WHERE path = ? AND container IS NULL", (path,)
+            )}
+            imported, stars = {}, []
+            for module, name, alias in self._db.execute(
+                "SELECT module, name, alias FROM imports WHERE path = ? ORDER BY line", (path,)
+            ):
+                if name is None:
+                    # "import a.b" binds a; "import a.b as c" binds c to a.b
+                    head = module.split(".")[0]
+                    imported[alias or head] = (module if alias else head, None)
+                elif name == "*":
+                    stars.append(module)
+                else:
+                    imported[alias or name] = (module, name)
+            cache[key] = (defined, imported, stars)
+        return cache[key]
+
+    def _resolve(self, path, name, cache, depth=0):
+        """The (path, name) of the definition the top-level ``name`` of module ``path`` stands for, or None"""
+        if path is None or depth > MAX_IMPORT_DEPTH:
+            return None
+        defined, imported, stars = self._bindings(path, cache)
+        if name in defined:
+            return path, name
+        if name in imported:
+            module, original = imported[name]
+            if original is None:
+                return None
+            return self._resolve(self._module_path(module, path, cache), original, cache, depth + 1)
+        for module in stars:
+            target = self._resolve(self._module_path(module, path, cache), name, cache, depth + 1)
+            if target is not None:
+                return target
+        return None
+
+    def _target(self, path, name, scope, qualifier, cache):
+        """The definition an occurrence refers to, if it is a workspace module's top-level name"""
+        if scope == SCOPE_MODULE:
+            return self._resolve(path, name, cache)
+        if scope == SCOPE_IMPORT:
+            return self._resolve(self._module_path(qualifier, path, cache), name, cache)
+        if scope == SCOPE_ATTRIBUTE and qualifier:
+            head, _, rest = qualifier.partition(".")
+            module, original = self._bindings(path, cache)[1].get(head, (None, None))
+            if module is None:
+                return None
+            if original is not None:
+                module = module + original if module.endswith(".") else f"{module}.{original}"
+            if rest:
+                module = f"{module}.{rest}"
+            return self._resolve(self._module_path(module, path, cache), name, cache)
+        return None
+
+    def _target_at(self, path, line, character):
+        # Entries left over from before a syntax error may not match the text any more
+        if path in self._unparsed:
+            return None
+        row = self._db.execute(
+            "SELECT name, scope, qualifier FROM refs "
+            "WHERE path = ? AND line = ? AND character <= ? AND end_character >= ? LIMIT 1",
+            (path, line, character, character),
+        ).fetchone()
+        return self._target(path, *row, {}) if row is not None else None
+
+    def _references(self, target, include_declaration, limit):
+        cache = {}
+        # Every name the definition is imported under somewhere
+        names, new = set(), {target[1]}
+        while new:
+            names |= new
+            placeholders = ", ".join("?" * len(new))
+            new = {alias for (alias,) in self._db.execute(
+                f"SELECT DISTINCT alias FROM imports WHERE name IN ({placeholders}) AND alias IS NOT NULL", list(new)
+            )} - names
+        placeholders = ", ".join("?" * len(names))
+        sql = (
+            f"SELECT path, line, character, end_character, name, scope, qualifier FROM refs "
+            f"WHERE name IN ({placeholders}) AND (scope IN ({SCOPE_MODULE}, {SCOPE_IMPORT}) "
+            f"OR (scope = {SCOPE_ATTRIBUTE} AND qualifier IS NOT NULL))"
+        )
+        if not include_declaration:
+            sql += " AND is_definition = 0"
+        rows = []
+        for path, line, character, end_character, name, scope, qualifier in self._db.execute(
+            sql + " ORDER BY path, line, character", list(names)
+        ).fetchall():
+            if self._target(path, name, scope, qualifier, cache) == target:
+                rows.append((path, line, character, end_character))
+                if len(rows) == limit:
+                    break
+        return rows
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # Event loop side
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _submit(self, function, *args):
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Symbol index update failed", exc_info=future.exception())
+
+    def contains(self, path):
+        return bool(path) and path.endswith((".py", ".pyi")) and \
+            os.path.abspath(path).startswith(self.root_path + os.sep)
+
+    async def open(self):
+        await self._call(self._connect)
+
+    async def scan(self):
+        return await self._call(self._scan)
+
+    async def run(self, interval):
+        """Rescan the workspace every ``interval`` seconds; call ``open`` first"""
+        while True:
+            result = await self.scan()
+            if result["indexed"] or result["removed"]:
+                log.info("Symbol index scan: %s", result)
+            await asyncio.sleep(interval)
+
+    def buffer_opened(self, path, text):
+        """An editor opened ``path``; its buffer, not the disk, is now authoritative"""
+        if self.contains(path):
+            self._open_buffers[path] += 1
+            self.buffer_changed(path, text, delay=0)
+
+    def buffer_changed(self, path, text, delay=0.5):
+        """Re-index an open buffer once typing pauses for ``delay`` seconds"""
+        if not self.contains(path):
+            return
+        pending = self._debounced.pop(path, None)
+        if pending is not None:
+            pending[1].cancel()
+        if delay <= 0:
+            self._submit(self._index_text, path, text)
+            return
+        handle = asyncio.get_running_loop().call_later(delay, self._flush_one, path)
+        self._debounced[path] = (text, handle)
+
+    def _flush_one(self, path):
+        pending = self._debounced.pop(path, None)
+        if pending is not None:
+            self._submit(self._index_text, path, pending[0])
+
+    def flush(self):
+        """Index pending buffer edits now; queries submitted afterwards will see them"""
+        for path in list(self._debounced):
+            self._debounced[path][1].cancel()
+            self._flush_one(path)
+
+    def buffer_closed(self, path):
+        if not self.contains(path) or self._open_buffers[path] <= 0:
+            return
+        self._open_buffers[path] -= 1
+        if self._open_buffers[path] == 0:
+            del self._open_buffers[path]
+            pending = self._debounced.pop(path, None)
+            if pending is not None:
+                pending[1].cancel()
+            self._submit(self._index_from_disk, path)
+
+    def file_changed(self, path):
+        """A file was created, changed or deleted on disk (watched-file notifications)"""
+        if self.contains(path) and path not in self._open_buffers:
+            self._submit(self._index_from_disk, path)
+
+    def has_definition(self, name):
+        """Whether some workspace module defines ``name`` at its top level"""
+        return self.definition_names.get(name, 0) > 0
+
+    async def search(self, query, limit=100):
+        """Symbols matching ``query`` by prefix or fuzzy subsequence, best first"""
+        self.flush()
+        rows = await self._call(self._search, query, limit)
+        return [
+            {
+                "name": name,
+                "kind": kind,
+                "containerName": container,
+                "location": {
+                    "uri": Path(path).as_uri(),
+                    "range": {
+                        "start": {"line": line, "character": character},
+                        "end": {"line": end_line, "character": end_character},
+                    },
+                },
+            }
+            for name, kind, container, path, line, character, end_line, end_character in rows
+        ]
+
+    async def definition_at(self, path, position):
+        """The (path, name) of the workspace definition the occurrence at an LSP position refers to
+
+        None for locals, class members, attributes that are not looked up on a
+        module, names defined outside the workspace, positions not on a name
+        and buffers whose latest text does not parse.
+        """
+        self.flush()
+        return await self._call(self._target_at, path, position["line"], position["character"])
+
+    async def references(self, definition, include_declaration=True, limit=10000):
+        """Locations of every occurrence that resolves to ``definition``, a (path, name) pair"""
+        self.flush()
+        rows = await self._call(self._references, tuple(definition), include_declaration, limit)
+        return [
+            {
+                "uri": Path(path).as_uri(),
+                "range": {
+                    "start": {"line": line, "character": character},
+                    "end": {"line": line, "character": end_character},
+                },
+            }
+            for path, line, character, end_character in rows
+        ]
+
+    def stats(self):
+        return {
+            "defined_names": len(self.definition_names),
+            "open_buffers": len(self._open_buffers),
+            "last_scan": self.last_scan,
+        }
+
+    async def close(self):
+        self.flush()
+        await self._call(self._close)
+        self._executor.shutdown(wait=True)
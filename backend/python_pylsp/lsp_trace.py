@@ -0,0 +1,468 @@
+"""Opt-in per-request tracing and profiling of the pylsp workers.
+
+A request's time is split into phases, measured on both sides of the
+worker's stdio pipe:
+
+- ``backlog``: received by the supervisor until written to the worker (only
+  non-zero while a session is being handed over);
+- ``queue``: written to the worker until pylsp's reader thread dequeues it,
+  i.e. time spent behind earlier messages;
+- ``handle``: dequeued until pylsp produced the response, with the time of
+  every plugin hook call inside it (``pylsp_completions`` from
+  ``rope_completion``, ``pylsp_lint`` from ``pylsp_mypy``, ...);
+- ``reply``: response produced until the supervisor wrote it to the client.
+
+Requests the supervisor answers itself (formatting cache, symbol index) have
+a single ``supervisor`` phase. Timestamps are wall-clock (``time.time()``) so
+the supervisor and workers on the same host share one clock.
+
+Worker side: running this module instead of ``python -m pylsp`` starts pylsp
+with ``WorkerInstrumentation`` wired into its JSON-RPC endpoint. Each
+response carries a ``_timing`` member (dequeued/finished times, hook calls
+and, for a sampled request slower than ``PYLSP_PROFILE_SLOW_MS``, the path of
+a cProfile dump written to ``PYLSP_PROFILE_DIR``). Hooks that run outside a
+request, such as debounced linting, ride along on the next message the same
+thread sends (usually ``publishDiagnostics``); hooks run while handling a
+notification are reported in a ``$/pylsp/timing`` notification.
+
+Supervisor side: ``Tracer`` strips those members, feeds Prometheus
+histograms served on ``/metrics`` and appends Chrome trace-event records to
+``PYLSP_TRACE_PATH``, which chrome://tracing and https://ui.perfetto.dev
+load directly.
+"""
+import bisect
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+log = logging.getLogger("lsp_trace")
+
+TIMING_FIELD = "_timing"
+TIMING_NOTIFICATION = "$/pylsp/timing"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Trace-event "processes": one track per session, one per worker for background work
+SESSIONS_PID = 1
+WORKERS_PID = 2
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def metric_lines(name, kind, documentation, samples):
+    """Prometheus text exposition of one gauge or counter; samples are (labels dict, value)"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return lines
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names"""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, labels):
+        series = self.series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class RequestTrace:
+    """Timestamps of one client request as it passes through the supervisor"""
+
+    __slots__ = ("session", "id", "method", "received", "forwarded", "worker_pid", "worker", "replied", "sent")
+
+    def __init__(self, session, request_id, method):
+        self.session = session
+        self.id = request_id
+        self.method = method
+        self.received = time.time()
+        self.forwarded = None
+        self.worker_pid = None
+        self.worker = None  # the worker's _timing member, if it is instrumented
+        self.replied = None
+        self.sent = None
+
+    def phases(self):
+        """(phase, start, end) in order, ending when the response was sent"""
+        if self.forwarded is None:
+            return [("supervisor", self.received, self.sent)]
+        phases = [("backlog", self.received, self.forwarded)]
+        if self.worker is not None:
+            dequeued, finished = self.worker["dequeued"], self.worker["finished"]
+            phases += [("queue", self.forwarded, dequeued), ("handle", dequeued, finished), ("reply", finished, self.sent)]
+        elif self.replied is not None:
+            phases += [("worker", self.forwarded, self.replied), ("reply", self.replied, self.sent)]
+        else:
+            # Never answered by a worker (e.g. interrupted by a handover)
+            phases.append(("worker", self.forwarded, self.sent))
+        return phases
+
+
+class Tracer:
+    """Aggregates request traces into metrics and, optionally, a trace-event log"""
+
+    def __init__(self, trace_path="", max_bytes=64 * 1024 * 1024):
+        self.trace_path = trace_path
+        self.max_bytes = max_bytes
+        self.request_seconds = Histogram(
+            "pylsp_request_duration_seconds",
+            "Time from a request reaching the supervisor until its response was sent.",
+            ("method", "outcome"),
+        )
+        self.phase_seconds = Histogram(
+            "pylsp_request_phase_seconds",
+            "Time requests spent in each phase (backlog, queue, handle, reply, worker, supervisor).",
+            ("method", "phase"),
+        )
+        self.hook_seconds = Histogram(
+            "pylsp_plugin_hook_seconds",
+            "Time spent in pylsp plugin hook implementations.",
+            ("hook", "plugin", "method"),
+        )
+        self.profiles = 0
+        self._file = None
+        self._named_tracks = set()
+
+    def begin(self, session, request_id, method):
+        return RequestTrace(session, request_id, method)
+
+    def finish(self, trace, response):
+        """Record a request once its response has been sent to the client"""
+        trace.sent = time.time()
+        outcome = "error" if "error" in response else "ok"
+        self.request_seconds.observe((trace.method, outcome), max(0.0, trace.sent - trace.received))
+        for phase, start, end in trace.phases():
+            self.phase_seconds.observe((trace.method, phase), max(0.0, end - start))
+        hooks = self._observe_hooks(trace.method, trace.worker)
+        profile = trace.worker.get("profile") if trace.worker else None
+        if profile:
+            self.profiles += 1
+
+        if self.trace_path:
+            self._name_track(SESSIONS_PID, trace.session, f"session {trace.session}")
+            args = {"id": trace.id, "outcome": outcome, "worker": trace.worker_pid}
+            if profile:
+                args["profile"] = profile
+            events = [self._event(trace.method, "request", trace.received, trace.sent, SESSIONS_PID, trace.session, args)]
+            events += [
+                self._event(phase, "phase", start, end, SESSIONS_PID, trace.session)
+                for phase, start, end in trace.phases()
+            ]
+            events += [
+                self._event(f"{plugin}.{hook}", "hook", start, start + duration, SESSIONS_PID, trace.session)
+                for hook, plugin, start, duration in hooks
+            ]
+            self._write(events)
+
+    def worker_activity(self, method, timing, worker_pid):
+        """Record plugin hooks a worker ran outside of a request (notifications, linting)"""
+        method = method or "background"
+        hooks = self._observe_hooks(method, timing)
+        if self.trace_path and hooks:
+            self._name_track(WORKERS_PID, worker_pid, f"worker {worker_pid}")
+            events = [self._event(method, "background", timing["dequeued"], timing["finished"], WORKERS_PID, worker_pid)]
+            events += [
+                self._event(f"{plugin}.{hook}", "hook", start, start + duration, WORKERS_PID, worker_pid)
+                for hook, plugin, start, duration in hooks
+            ]
+            self._write(events)
+
+    def _observe_hooks(self, method, timing):
+        hooks = (timing or {}).get("hooks") or []
+        for hook, plugin, _, duration in hooks:
+            self.hook_seconds.observe((hook, plugin, method), duration)
+        return hooks
+
+    def render(self):
+        return (
+            self.request_seconds.render()
+            + self.phase_seconds.render()
+            + self.hook_seconds.render()
+            + metric_lines("pylsp_profiles_total", "counter", "cProfile dumps written for slow requests.",
+                           [({}, self.profiles)])
+        )
+
+    @staticmethod
+    def _event(name, category, start, end, pid, tid, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(start * 1e6),
+            "dur": max(0, round((end - start) * 1e6)),
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        return event
+
+    def _name_track(self, pid, tid, name):
+        if (pid, tid) not in self._named_tracks:
+            self._named_tracks.add((pid, tid))
+            self._write([{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}])
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.trace_path) or ".", exist_ok=True)
+        # The JSON array is left open: trace viewers accept a missing "]", and so can we keep appending
+        self._file = open(self.trace_path, "w", buffering=1, encoding="utf-8")
+        self._file.write("[\n")
+        self._named_tracks = set()
+        for pid, name in ((SESSIONS_PID, "editor sessions"), (WORKERS_PID, "pylsp workers")):
+            self._file.write(json.dumps({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}) + ",\n")
+
+    def _write(self, events):
+        try:
+            if self._file is None:
+                self._open()
+            for event in events:
+                self._file.write(json.dumps(event, separators=(",", ":")) + ",\n")
+            if self._file.tell() > self.max_bytes:
+                self._file.close()
+                self._file = None
+                os.replace(self.trace_path, self.trace_path + ".1")
+        except OSError as e:
+            log.error("Disabling the trace log, cannot write %s: %s", self.trace_path, e)
+            self.trace_path = ""
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_trace(path):
+    """Parse a trace log written by ``Tracer`` into its list of events"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read().rstrip().rstrip(",")
+    return json.loads(text + "]")
+
+
+# Worker side: runs inside the pylsp process
+
+_active = threading.local()
+
+
+class _Timer:
+    """Hook calls of one request or notification handled by a pylsp worker"""
+
+    __slots__ = ("method", "dequeued", "hooks", "thread", "profiler")
+
+    def __init__(self, method=None):
+        self.method = method
+        self.dequeued = time.time()
+        self.hooks = []
+        self.thread = threading.get_ident()
+        self.profiler = None
+
+    def stop_profiler(self):
+        """Stop profiling if it was started on this thread; returns the profiler"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None and self.thread == threading.get_ident():
+            profiler.disable()
+            return profiler
+        return None
+
+
+def _timed_hook(hook_name, plugin_name, function):
+    @functools.wraps(function)
+    def timed(*args):
+        timer = getattr(_active, "timer", None)
+        if timer is None:
+            # Outside a request, e.g. linting on pylsp's debounce thread
+            timer = getattr(_active, "background", None)
+            if timer is None:
+                timer = _active.background = _Timer()
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            timer.hooks.append([hook_name, plugin_name, started, time.perf_counter() - clock])
+
+    timed.traced = True
+    return timed
+
+
+def instrument_plugins(plugin_manager):
+    """Time every plain implementation of every hook registered with a pluggy manager"""
+    for hook_name, caller in vars(plugin_manager.hook).items():
+        if not hasattr(caller, "get_hookimpls"):
+            continue
+        for impl in caller.get_hookimpls():
+            if impl.hookwrapper or getattr(impl, "wrapper", False) or getattr(impl.function, "traced", False):
+                continue
+            impl.function = _timed_hook(hook_name, impl.plugin_name, impl.function)
+
+
+class WorkerInstrumentation:
+    """Wraps a pylsp_jsonrpc ``Endpoint`` to time requests and attach the timings to responses"""
+
+    _dumps = itertools.count(1)
+
+    def __init__(self, endpoint, profile_dir="", profile_sample=0.0, profile_slow_ms=500.0, profile_keep=100):
+        self.profile_dir = profile_dir
+        self.profile_sample = profile_sample
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_keep = profile_keep
+        self._timers = {}
+        self._consumer = endpoint._consumer
+        self._handle_request = endpoint._handle_request
+        self._handle_notification = endpoint._handle_notification
+        endpoint._consumer = self.consume
+        endpoint._handle_request = self.handle_request
+        endpoint._handle_notification = self.handle_notification
+
+    @classmethod
+    def from_env(cls, endpoint, environ=os.environ):
+        return cls(
+            endpoint,
+            profile_dir=environ.get("PYLSP_PROFILE_DIR", ""),
+            profile_sample=float(environ.get("PYLSP_PROFILE_SAMPLE") or 0.1),
+            profile_slow_ms=float(environ.get("PYLSP_PROFILE_SLOW_MS") or 500.0),
+            profile_keep=int(environ.get("PYLSP_PROFILE_KEEP") or 100),
+        )
+
+    def handle_request(self, msg_id, method, params):
+        timer = self._timers[msg_id] = _Timer(method)
+        previous, _active.timer = getattr(_active, "timer", None), timer
+        if self.profile_dir and random.random() < self.profile_sample:
+            timer.profiler = cProfile.Profile()
+            timer.profiler.enable()
+        try:
+            return self._handle_request(msg_id, method, params)
+        finally:
+            _active.timer = previous
+            # Still set if the handler deferred its work to pylsp's thread pool; not worth keeping
+            timer.stop_profiler()
+
+    def handle_notification(self, method, params):
+        timer = _Timer(method)
+        previous, _active.timer = getattr(_active, "timer", None), timer
+        try:
+            return self._handle_notification(method, params)
+        finally:
+            _active.timer = previous
+            if timer.hooks:
+                self._consumer({
+                    "jsonrpc": "2.0",
+                    "method": TIMING_NOTIFICATION,
+                    "params": {"method": method, "timing": self._timing(timer)},
+                })
+
+    def consume(self, message):
+        """Write a message to the client, attaching the timings it completes"""
+        timer = None
+        if "id" in message and "method" not in message:
+            timer = self._timers.pop(message["id"], None)
+        background = getattr(_active, "background", None)
+        if background is not None:
+            _active.background = None
+            if timer is None:
+                timer = background
+            else:
+                timer.hooks.extend(background.hooks)
+        if timer is not None:
+            message = dict(message)
+            message[TIMING_FIELD] = self._timing(timer)
+        self._consumer(message)
+
+    def _timing(self, timer):
+        finished = time.time()
+        profile = None
+        profiler = timer.stop_profiler()
+        elapsed_ms = (finished - timer.dequeued) * 1000.0
+        if profiler is not None and elapsed_ms >= self.profile_slow_ms:
+            profile = self._dump(profiler, timer.method, elapsed_ms)
+        return {"dequeued": timer.dequeued, "finished": finished, "hooks": timer.hooks, "profile": profile}
+
+    def _dump(self, profiler, method, elapsed_ms):
+        name = "{}-{}-{:06d}-{}-{:.0f}ms.prof".format(
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime()), os.getpid(), next(self._dumps),
+            (method or "request").replace("/", "_"), elapsed_ms,
+        )
+        path = os.path.join(self.profile_dir, name)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(path)
+            dumps = sorted(
+                (entry for entry in os.scandir(self.profile_dir) if entry.name.endswith(".prof")),
+                key=lambda entry: (entry.stat().st_mtime_ns, entry.name),
+            )
+            for entry in dumps[:max(0, len(dumps) - self.profile_keep)]:
+                os.unlink(entry.path)
+        except OSError as e:
+            log.error("Could not write profile %s: %s", path, e)
+            return None
+        return path
+
+
+class TracingServerMixin:
+    """Mixed into pylsp's ``PythonLSPServer`` to instrument its endpoint and plugins"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instrumentation = WorkerInstrumentation.from_env(self._endpoint)
+
+    def m_initialize(self, **kwargs):
+        # Every initialize builds a new Config and with it a new plugin manager
+        result = super().m_initialize(**kwargs)
+        instrument_plugins(self.config.plugin_manager)
+        return result
+
+
+def run_worker():
+    """Entry point of an instrumented worker; takes the same arguments as ``python -m pylsp``"""
+    import pylsp.__main__ as pylsp_main
+    from pylsp.python_lsp import PythonLSPServer
+
+    pylsp_main.PythonLSPServer = type("TracingPythonLSPServer", (TracingServerMixin, PythonLSPServer), {})
+    pylsp_main.main()
+
+
+if __name__ == "__main__":
+    sys.exit(run_worker())
@@ -0,0 +1,327 @@
+"""LSP latency benchmark for the Python language server.
+
+Replays a synthetic typing trace against a running pylsp instance (see
+docker-compose.yml) and reports p50/p95/p99 latency per LSP method plus
+overall throughput, for every combination of session count and document
+size requested on the command line.
+
+Usage:
+    python tests/benchmark_lsp.py --sessions 1,4,8 --lines 50,500,2000 \
+        --output benchmark-results.json
+
+The output JSON is written with sorted keys so CI can diff two runs.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lsp_client import LspClient, LspResponseError  # noqa: E402
+
+LSP_HOST = "localhost"
+LSP_PORT = 3000
+TIMEOUT = 10  # seconds
+
+# Lines typed at the end of the document by every session, one keystroke at a time
+TYPING_TRACE = [
+    "import os",
+    "",
+    "def summarize(values: list[int]) -> int:",
+    "    total = compute_0(len(values), 1)",
+    "    path = os.path.join(os.getcwd(), 'data')",
+    "    return total",
+    "",
+    "result = summarize([1, 2, 3])",
+]
+
+# Block repeated (with unique names) to build documents of the requested size
+DOCUMENT_BLOCK = '''
+def compute_{n}(a: int, b: int) -> int:
+    """Combine two numbers.
+
+    Parameters
+    ----------
+    a : int
+        First number
+    b : int
+        Second number
+    """
+    value = a * {n} + b
+    return value
+
+
+class Record{n}:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def describe(self) -> str:
+        return f"{{self.name}} #{n}"
+'''
+
+IDENTIFIER_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+DIAGNOSTICS_METHOD = "textDocument/publishDiagnostics"
+
+
+def make_document(lines):
+    """Build a valid Python document with at least `lines` lines"""
+    blocks = []
+    n = 0
+    while sum(block.count("\n") for block in blocks) < lines:
+        blocks.append(DOCUMENT_BLOCK.format(n=n))
+        n += 1
+    return "".join(blocks)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+    return samples[rank - 1]
+
+
+def initialize_params():
+    """Parameters for the initialize request, matching the test suite"""
+    return {
+        "processId": os.getpid(),
+        "rootPath": None,
+        "rootUri": "file:///app/workspace",
+        "capabilities": {},
+        "trace": "off",
+        "workspaceFolders": None
+    }
+
+
+class BenchmarkSession:
+    """One editor session replaying the typing trace over its own connection"""
+
+    def __init__(self, index, document, timeout):
+        self.uri = f"file:///app/workspace/bench_{index}.py"
+        self.document = document
+        self.client = None
+        self.timeout = timeout
+        self.samples = {}
+        self.errors = 0
+        self.version = 1
+        self.diagnostics = None
+
+    def record(self, method, elapsed):
+        """Store a latency sample in milliseconds"""
+        self.samples.setdefault(method, []).append(elapsed * 1000.0)
+
+    async def request(self, method, params):
+        """Send a request, wait for its response and record the latency"""
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await self.client.request(method, params, timeout=self.timeout)
+        except LspResponseError:
+            self.errors += 1
+        # Timeouts and dropped connections raise before a sample is taken, so they cannot skew the percentiles
+        self.record(method, time.perf_counter() - start)
+        return result
+
+    async def wait_for_diagnostics(self, start):
+        """Wait until diagnostics for our document are published after a save"""
+        deadline = start + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            try:
+                message = await self.diagnostics.get(timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                self.errors += 1
+                return
+            if message["params"].get("uri") == self.uri:
+                self.record(DIAGNOSTICS_METHOD, time.perf_counter() - start)
+                return
+
+    async def open(self, host, port):
+        """Connect, initialize and open the benchmark document"""
+        self.client = await LspClient.connect(host, port, timeout=self.timeout)
+        self.diagnostics = self.client.subscribe(DIAGNOSTICS_METHOD)
+        await self.client.initialize(initialize_params(), timeout=self.timeout)
+        self.client.notify(
+            "textDocument/didOpen",
+            {
+                "textDocument": {
+                    "uri": self.uri,
+                    "languageId": "python",
+                    "version": self.version,
+                    "text": self.document
+                }
+            }
+        )
+
+    def type_char(self, line, character, char):
+        """Insert a single character at the given position"""
+        self.version += 1
+        self.client.notify(
+            "textDocument/didChange",
+            {
+                "textDocument": {"uri": self.uri, "version": self.version},
+                "contentChanges": [
+                    {
+                        "range": {
+                            "start": {"line": line, "character": character},
+                            "end": {"line": line, "character": character}
+                        },
+                        "text": char
+                    }
+                ]
+            }
+        )
+
+    async def replay(self):
+        """Type the trace at the end of the document, querying like an editor would"""
+        text_document = {"textDocument": {"uri": self.uri}}
+        line = self.document.count("\n")
+        for trace_line in TYPING_TRACE:
+            for character, char in enumerate(trace_line):
+                self.type_char(line, character, char)
+                position = {"line": line, "character": character + 1}
+                if char in IDENTIFIER_CHARS or char == ".":
+                    await self.request(
+                        "textDocument/completion",
+                        dict(text_document, position=position, context={"triggerKind": 1})
+                    )
+                elif char == "(" and character > 0:
+                    await self.request(
+                        "textDocument/hover",
+                        dict(text_document, position={"line": line, "character": character - 1})
+                    )
+            self.type_char(line, len(trace_line), "\n")
+            line += 1
+
+            # End of line: format, then save and wait for the linters to report
+            await self.request(
+                "textDocument/formatting",
+                dict(text_document, options={"tabSize": 4, "insertSpaces": True})
+            )
+            # Only diagnostics published after this save count towards its latency
+            self.diagnostics.drain()
+            start = time.perf_counter()
+            self.client.notify("textDocument/didSave", text_document)
+            await self.wait_for_diagnostics(start)
+
+    async def close(self):
+        """Shut the session down politely"""
+        if self.client is None:
+            return
+        try:
+            await self.client.shutdown(timeout=self.timeout)
+        except (TimeoutError, ConnectionError, LspResponseError):
+            self.errors += 1
+
+
+async def run_scenario(sessions, lines, host, port, timeout):
+    """Run `sessions` concurrent sessions on a document of `lines` lines"""
+    document = make_document(lines)
+    workers = [BenchmarkSession(i, document, timeout) for i in range(sessions)]
+    failures = []
+
+    async def guarded(session, step):
+        try:
+            await step
+        except (TimeoutError, ConnectionError, OSError) as e:
+            failures.append(f"{session.uri}: {e}")
+            session.errors += 1
+            return False
+        return True
+
+    # Open every session first so the timed section measures steady-state traffic
+    opened = await asyncio.gather(
+        *(guarded(session, session.open(host, port)) for session in workers)
+    )
+    start = time.perf_counter()
+    if all(opened):
+        await asyncio.gather(*(guarded(session, session.replay()) for session in workers))
+    duration = time.perf_counter() - start
+    await asyncio.gather(*(session.close() for session in workers))
+
+    merged = {}
+    for session in workers:
+        for method, samples in session.samples.items():
+            merged.setdefault(method, []).extend(samples)
+
+    methods = {}
+    for method, samples in merged.items():
+        samples.sort()
+        methods[method] = {
+            "count": len(samples),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(samples[-1], 3)
+        }
+
+    requests = sum(stats["count"] for method, stats in methods.items() if method != DIAGNOSTICS_METHOD)
+    return {
+        "sessions": sessions,
+        "document_lines": lines,
+        "duration_s": round(duration, 3),
+        "requests": requests,
+        "errors": sum(session.errors for session in workers),
+        "failures": sorted(failures),
+        "throughput_rps": round(requests / duration, 3) if duration > 0 else None,
+        "methods": methods
+    }
+
+
+def parse_int_list(value):
+    """Parse a comma-separated list of positive integers"""
+    try:
+        numbers = [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated integers, got {value!r}")
+    if not numbers or any(n <= 0 for n in numbers):
+        raise argparse.ArgumentTypeError(f"expected positive integers, got {value!r}")
+    return numbers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark LSP request latency against pylsp")
+    parser.add_argument("--host", default=LSP_HOST)
+    parser.add_argument("--port", type=int, default=LSP_PORT)
+    parser.add_argument("--sessions", type=parse_int_list, default=[1, 4],
+                        help="comma-separated concurrent session counts (default: 1,4)")
+    parser.add_argument("--lines", type=parse_int_list, default=[50, 500],
+                        help="comma-separated document sizes in lines (default: 50,500)")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT,
+                        help="seconds to wait for any single response")
+    parser.add_argument("--output", default="benchmark-results.json",
+                        help="path of the JSON report")
+    args = parser.parse_args(argv)
+
+    results = []
+    for lines in args.lines:
+        for sessions in args.sessions:
+            print(f"Running {sessions} session(s) on a {lines}-line document...")
+            result = asyncio.run(run_scenario(sessions, lines, args.host, args.port, args.timeout))
+            results.append(result)
+            for method, stats in sorted(result["methods"].items()):
+                print(f"  {method:35} n={stats['count']:<5} p50={stats['p50_ms']:>9.1f}ms "
+                      f"p95={stats['p95_ms']:>9.1f}ms p99={stats['p99_ms']:>9.1f}ms")
+            print(f"  throughput: {result['throughput_rps']} req/s, errors: {result['errors']}")
+
+    report = {
+        "python": platform.python_version(),
+        "server": f"{args.host}:{args.port}",
+        "trace_keystrokes": sum(len(line) + 1 for line in TYPING_TRACE),
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {args.output}")
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""Minimal stdio language server standing in for pylsp in supervisor tests.
+
+Hover answers with the full text of the hovered document, so tests can tell
+what a worker was sent. Formatting puts single spaces around ``=`` and
+``fake/formatCount`` reports how often it ran. ``fake/pid`` answers with the
+process id. After a
+``fake/wedge`` notification hovers go unanswered, like a worker stuck in a
+long mypy run. Like a worker started through ``lsp_trace``, hover responses
+carry ``_timing`` and opening a document reports its hook in a
+``$/pylsp/timing`` notification.
+"""
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lsp_client import MessageBuffer, encode_message  # noqa: E402
+from lsp_documents import DocumentStore  # noqa: E402
+from lsp_trace import TIMING_FIELD, TIMING_NOTIFICATION  # noqa: E402
+
+
+def timing(hook, plugin):
+    started = time.time()
+    return {"dequeued": started, "finished": started + 0.002, "hooks": [[hook, plugin, started, 0.001]], "profile": None}
+
+
+def main():
+    documents = DocumentStore()
+    buffer = MessageBuffer()
+    wedged = False
+    formats = 0
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+
+    while data := stdin.read1(65536):
+        buffer.feed(data)
+        for message in buffer.messages():
+            method = message.get("method")
+            documents.observe(message)
+            if "id" not in message:
+                if method == "exit":
+                    return
+                if method == "textDocument/didOpen":
+                    stdout.write(encode_message({"jsonrpc": "2.0", "method": TIMING_NOTIFICATION, "params": {
+                        "method": method, "timing": timing("pylsp_document_did_open", "fake_plugin")
+                    }}))
+                    stdout.flush()
+                wedged = wedged or method == "fake/wedge"
+                continue
+            result = None
+            extra = {}
+            if method == "initialize":
+                result = {"capabilities": {"hoverProvider": True, "textDocumentSync": 2}}
+            elif method == "textDocument/hover":
+                if wedged:
+                    continue
+                document = documents.get(message["params"]["textDocument"]["uri"])
+                result = {"contents": document.text if document else ""}
+                extra[TIMING_FIELD] = timing("pylsp_hover", "jedi_hover")
+            elif method == "textDocument/formatting":
+                formats += 1
+                text = documents.get(message["params"]["textDocument"]["uri"]).text
+                formatted = re.sub(r" *= *", " = ", text)
+                result = [] if formatted == text else [{
+                    "range": {"start": {"line": 0, "character": 0},
+                              "end": {"line": text.count("\n") + 1, "character": 0}},
+                    "newText": formatted
+                }]
+            elif method == "fake/formatCount":
+                result = formats
+            elif method == "fake/pid":
+                result = os.getpid()
+            stdout.write(encode_message({"jsonrpc": "2.0", "id": message["id"], "result": result, **extra}))
+            stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
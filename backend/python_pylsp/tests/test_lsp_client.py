@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+from lsp_client import (
+    LspClient,
+    LspProtocolError,
+    LspResponseError,
+    MessageBuffer,
+    encode_message,
+)
+
+
+def test_encode_counts_utf8_bytes():
+    """Content-Length must be the byte length of the body, not its character count."""
+    message = {"jsonrpc": "2.0", "method": "x", "params": {"text": "héllo → 世界 🐍"}}
+    framed = encode_message(message)
+    header, body = framed.split(b"\r\n\r\n", 1)
+    assert int(header.split(b": ")[1]) == len(body)
+    assert json.loads(body.decode("utf-8")) == message
+
+
+def test_buffer_decodes_byte_at_a_time():
+    """Messages split at arbitrary points (even inside a UTF-8 sequence) decode intact."""
+    messages = [{"id": i, "result": {"label": "naïve ✓" * i}} for i in range(1, 4)]
+    stream = b"".join(encode_message(m) for m in messages)
+    buffer = MessageBuffer(initial_size=16)
+    decoded = []
+    for i in range(len(stream)):
+        buffer.feed(stream[i:i + 1])
+        decoded.extend(buffer.messages())
+    assert decoded == messages
+    assert len(buffer) == 0
+
+
+def test_buffer_decodes_many_messages_in_one_chunk():
+    messages = [{"id": i, "result": None} for i in range(100)]
+    buffer = MessageBuffer()
+    buffer.feed(b"".join(encode_message(m) for m in messages))
+    assert list(buffer.messages()) == messages
+
+
+def test_buffer_handles_large_body():
+    """A response much larger than the read chunk size is assembled without loss."""
+    items = [{"label": f"item_{i}", "detail": "ü" * 20} for i in range(20000)]
+    framed = encode_message({"id": 1, "result": {"items": items}})
+    buffer = MessageBuffer()
+    for offset in range(0, len(framed), 1000):
+        buffer.feed(framed[offset:offset + 1000])
+        if offset + 1000 < len(framed):
+            assert buffer.next_message() is None
+    assert buffer.next_message()["result"]["items"] == items
+
+
+def test_buffer_rejects_missing_content_length():
+    buffer = MessageBuffer()
+    buffer.feed(b"Content-Type: application/json\r\n\r\n{}")
+    with pytest.raises(LspProtocolError):
+        buffer.next_message()
+
+
+@contextlib.asynccontextmanager
+async def _serve(handler):
+    """Run a throwaway server that calls handler(message, write) per client message."""
+    connections = []
+
+    async def on_connect(reader, writer):
+        connections.append(asyncio.current_task())
+        buffer = MessageBuffer()
+        try:
+            while data := await reader.read(4096):
+                buffer.feed(data)
+                for message in buffer.messages():
+                    await handler(message, lambda m: writer.write(encode_message(m)))
+        except ConnectionResetError:
+            pass
+        writer.close()
+        await writer.wait_closed()
+
+    server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+    async with server:
+        yield server.sockets[0].getsockname()[1]
+        if connections:
+            await asyncio.wait(connections, timeout=5)
+
+
+def test_concurrent_requests_are_matched_by_id():
+    """Responses sent back in reverse order still resolve the right requests."""
+    async def run():
+        held = []
+
+        async def handler(message, write):
+            if message.get("method") == "echo":
+                held.append((message, write))
+                if len(held) == 20:
+                    for request, reply in reversed(held):
+                        reply({"jsonrpc": "2.0", "id": request["id"], "result": request["params"]})
+            elif message.get("method") == "fail":
+                write({"jsonrpc": "2.0", "id": message["id"],
+                       "error": {"code": -32601, "message": "Method not found"}})
+
+        async with _serve(handler) as port:
+            client = await LspClient.connect("127.0.0.1", port)
+            results = await asyncio.gather(
+                *(client.request("echo", {"n": n, "text": "ß" * n}) for n in range(20))
+            )
+            assert results == [{"n": n, "text": "ß" * n} for n in range(20)]
+            with pytest.raises(LspResponseError) as excinfo:
+                await client.request("fail")
+            assert excinfo.value.code == -32601
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_notifications_reach_subscribers():
+    async def run():
+        async def handler(message, write):
+            if message.get("method") == "textDocument/didOpen":
+                uri = message["params"]["textDocument"]["uri"]
+                write({"jsonrpc": "2.0", "method": "window/logMessage",
+                       "params": {"type": 3, "message": "opened"}})
+                write({"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics",
+                       "params": {"uri": uri, "diagnostics": []}})
+
+        async with _serve(handler) as port:
+            client = await LspClient.connect("127.0.0.1", port)
+            logged = []
+            client.subscribe("window/logMessage", callback=logged.append)
+            diagnostics = client.subscribe("textDocument/publishDiagnostics")
+            everything = client.subscribe()
+            client.notify("textDocument/didOpen", {"textDocument": {"uri": "file:///a.py"}})
+
+            message = await diagnostics.get(timeout=5)
+            assert message["params"]["uri"] == "file:///a.py"
+            assert [m["params"]["message"] for m in logged] == ["opened"]
+            assert (await everything.get(timeout=5))["method"] == "window/logMessage"
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_pending_requests_fail_when_connection_drops():
+    async def run():
+        async def handler(message, write):
+            raise ConnectionResetError
+
+        async with _serve(handler) as port:
+            client = await LspClient.connect("127.0.0.1", port)
+            with pytest.raises(ConnectionError):
+                await client.request("anything", timeout=5)
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_subscribers_wake_when_connection_drops():
+    """Waiting subscribers end instead of hanging once the server goes away."""
+    async def run():
+        async def handler(message, write):
+            write({"jsonrpc": "2.0", "method": "window/logMessage", "params": {"message": "bye"}})
+            raise ConnectionResetError
+
+        async with _serve(handler) as port:
+            client = await LspClient.connect("127.0.0.1", port)
+            logs = client.subscribe("window/logMessage")
+            drained = client.subscribe("window/logMessage")
+            diagnostics = client.subscribe("textDocument/publishDiagnostics")
+            client.notify("exit")
+
+            # Messages queued before the drop are still delivered, then iteration stops
+            received = await asyncio.wait_for(_collect(logs), 5)
+            assert [m["params"]["message"] for m in received] == ["bye"]
+            assert [m["params"]["message"] for m in drained.drain()] == ["bye"]
+            assert drained.drain() == []
+            with pytest.raises(ConnectionError):
+                await drained.get(timeout=5)
+            with pytest.raises(ConnectionError):
+                await diagnostics.get(timeout=5)
+            with pytest.raises(ConnectionError):
+                await diagnostics.get(timeout=5)
+            with pytest.raises(ConnectionError):
+                await client.subscribe().get(timeout=5)
+            await client.close()
+
+    asyncio.run(run())
+
+
+async def _collect(subscription):
+    return [message async for message in subscription]
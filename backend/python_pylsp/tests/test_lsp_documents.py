@@ -0,0 +1,57 @@
+from lsp_documents import DocumentStore, TextDocument, apply_change, position_to_offset
+
+
+def change(start, end, text):
+    return {
+        "range": {
+            "start": {"line": start[0], "character": start[1]},
+            "end": {"line": end[0], "character": end[1]}
+        },
+        "text": text
+    }
+
+
+def test_incremental_insert_and_delete():
+    text = "def f():\n    return 1\n"
+    text = apply_change(text, change((1, 11), (1, 12), "42"))
+    assert text == "def f():\n    return 42\n"
+    text = apply_change(text, change((0, 8), (1, 4), " "))
+    assert text == "def f(): return 42\n"
+
+
+def test_full_document_replacement():
+    assert apply_change("old", {"text": "new"}) == "new"
+
+
+def test_characters_are_utf16_code_units():
+    """The snake emoji is one code point but two UTF-16 code units."""
+    text = 'x = "🐍é"\ny = 1\n'
+    assert position_to_offset(text, {"line": 0, "character": 7}) == text.index("é")
+    assert apply_change(text, change((0, 7), (0, 8), "e")) == 'x = "🐍e"\ny = 1\n'
+
+
+def test_crlf_and_out_of_range_positions():
+    text = "a = 1\r\nb = 2\r\n"
+    assert position_to_offset(text, {"line": 1, "character": 0}) == 7
+    # Past the end of a line clamps to the line end, past the last line to the document end
+    assert position_to_offset(text, {"line": 0, "character": 99}) == 5
+    assert position_to_offset(text, {"line": 9, "character": 0}) == len(text)
+
+
+def test_store_tracks_open_change_close():
+    store = DocumentStore()
+    uri = "file:///app/workspace/a.py"
+    store.observe({"method": "textDocument/didOpen", "params": {
+        "textDocument": {"uri": uri, "languageId": "python", "version": 1, "text": "x = 1\n"}
+    }})
+    store.observe({"method": "textDocument/didChange", "params": {
+        "textDocument": {"uri": uri, "version": 2},
+        "contentChanges": [change((0, 4), (0, 5), "2"), change((1, 0), (1, 0), "y = x\n")]
+    }})
+    document = store.get(uri)
+    assert isinstance(document, TextDocument)
+    assert document.to_item() == {"uri": uri, "languageId": "python", "version": 2, "text": "x = 2\ny = x\n"}
+
+    store.observe({"method": "textDocument/didClose", "params": {"textDocument": {"uri": uri}}})
+    assert uri not in store
+
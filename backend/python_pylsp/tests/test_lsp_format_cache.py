@@ -0,0 +1,63 @@
+from lsp_format_cache import ENTRY_OVERHEAD, FormatCache
+
+OPTIONS = {"tabSize": 4, "insertSpaces": True}
+UNFORMATTED = "def f( x ):\n    return x\n"
+FORMATTED = "def f(x):\n    return x\n"
+EDITS = [{
+    "range": {"start": {"line": 0, "character": 0}, "end": {"line": 2, "character": 0}},
+    "newText": FORMATTED
+}]
+
+
+def test_hit_returns_edits_and_formatted_text_is_a_no_op():
+    cache = FormatCache()
+    fingerprint = cache.fingerprint(None)
+    assert cache.get(UNFORMATTED, OPTIONS, fingerprint) is None
+
+    cache.store(UNFORMATTED, OPTIONS, fingerprint, EDITS)
+    assert cache.get(UNFORMATTED, OPTIONS, fingerprint) == EDITS
+    assert cache.get(FORMATTED, OPTIONS, fingerprint) == []
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_options_and_configuration_are_part_of_the_key(tmp_path):
+    cache = FormatCache()
+    pyproject = tmp_path / "pyproject.toml"
+    pyproject.write_text("[tool.black]\nline-length = 100\n")
+    fingerprint = cache.fingerprint(str(tmp_path), {"pylsp": {"plugins": {"black": {"enabled": True}}}})
+    cache.store(UNFORMATTED, OPTIONS, fingerprint, EDITS)
+
+    assert cache.get(UNFORMATTED, dict(OPTIONS, tabSize=2), fingerprint) is None
+    assert cache.fingerprint(str(tmp_path), {"pylsp": {}}) != fingerprint
+
+    pyproject.write_text("[tool.black]\nline-length = 88\n")
+    assert cache.fingerprint(str(tmp_path), {"pylsp": {"plugins": {"black": {"enabled": True}}}}) != fingerprint
+
+
+def test_config_nearest_the_document_is_part_of_the_key(tmp_path):
+    cache = FormatCache()
+    package = tmp_path / "services" / "api"
+    package.mkdir(parents=True)
+    document = str(package / "app.py")
+    fingerprint = cache.fingerprint(str(tmp_path), None, document)
+
+    (tmp_path / "services" / "pyproject.toml").write_text("[tool.black]\nline-length = 100\n")
+    assert cache.fingerprint(str(tmp_path), None, document) != fingerprint
+    # A sibling package's configuration does not apply
+    assert cache.fingerprint(str(tmp_path), None, str(tmp_path / "other" / "app.py")) == \
+        cache.fingerprint(str(tmp_path), None, str(tmp_path / "other" / "main.py"))
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = FormatCache(max_bytes=3 * ENTRY_OVERHEAD)
+    fingerprint = cache.fingerprint(None)
+    for text in ("a = 1\n", "b = 2\n", "c = 3\n"):
+        cache.store(text, OPTIONS, fingerprint, [])
+    assert cache.get("a = 1\n", OPTIONS, fingerprint) == []
+
+    cache.store("d = 4\n", OPTIONS, fingerprint, [])
+    assert cache.get("b = 2\n", OPTIONS, fingerprint) is None
+    assert cache.get("a = 1\n", OPTIONS, fingerprint) == []
+    assert len(cache) == 3
+    assert cache.stats()["evictions"] == 1
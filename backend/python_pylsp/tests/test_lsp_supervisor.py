@@ -0,0 +1,399 @@
+import asyncio
+import sys
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from lsp_client import LspClient, LspResponseError
+from lsp_supervisor import Supervisor, SupervisorConfig
+from lsp_trace import load_trace
+
+FAKE_PYLSP = [sys.executable, str(Path(__file__).parent / "fake_pylsp.py")]
+URI = "file:///app/workspace/editor.py"
+
+
+def make_config(**overrides):
+    config = SupervisorConfig(
+        host="127.0.0.1",
+        port=0,
+        health_port=0,
+        worker_command=FAKE_PYLSP,
+        monitor_interval=3600,
+        probe_timeout=2,
+        start_timeout=10,
+        drain_timeout=2,
+        symbol_index=0,
+    )
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
+
+
+async def start_supervisor(config):
+    supervisor = Supervisor(config)
+    await supervisor.start()
+    for _ in range(200):
+        if supervisor.ready:
+            break
+        await asyncio.sleep(0.05)
+    assert supervisor.ready, supervisor.status()
+    return supervisor
+
+
+async def open_session(supervisor, text):
+    client = await LspClient.connect("127.0.0.1", supervisor.port)
+    await client.initialize({"rootUri": "file:///app/workspace"})
+    client.notify("textDocument/didOpen", {
+        "textDocument": {"uri": URI, "languageId": "python", "version": 1, "text": text}
+    })
+    return client
+
+
+async def hover_text(client):
+    result = await client.request("textDocument/hover", {
+        "textDocument": {"uri": URI}, "position": {"line": 0, "character": 0}
+    }, timeout=5)
+    return result["contents"]
+
+
+def session_worker(supervisor):
+    (session,) = supervisor.sessions
+    return session.worker
+
+
+def test_config_from_env():
+    config = SupervisorConfig.from_env({
+        "PYLSP_PORT": "4000",
+        "PYLSP_MAX_RSS_MB": "512.5",
+        "PYLSP_WORKER_COMMAND": "python -m pylsp --verbose",
+    })
+    assert config.port == 4000
+    assert config.max_rss_mb == 512.5
+    assert config.worker_command == ["python", "-m", "pylsp", "--verbose"]
+    assert config.health_port == SupervisorConfig().health_port
+
+
+def test_flags_parse_like_the_entrypoint():
+    for value, expected in (("1", True), ("true", True), ("yes", True), ("0", False), ("False", False), ("off", False)):
+        config = SupervisorConfig.from_env({"PYLSP_TRACE": value, "PYLSP_SYMBOL_INDEX": value})
+        assert config.trace is expected
+        assert config.symbol_index is expected
+    assert SupervisorConfig.from_env({"PYLSP_TRACE": ""}).trace is False
+
+
+def test_recycle_hands_session_over_with_current_documents():
+    async def run():
+        supervisor = await start_supervisor(make_config())
+        try:
+            client = await open_session(supervisor, "x = 1\n")
+            client.notify("textDocument/didChange", {
+                "textDocument": {"uri": URI, "version": 2},
+                "contentChanges": [{"range": {"start": {"line": 1, "character": 0},
+                                              "end": {"line": 1, "character": 0}}, "text": "y = 2\n"}]
+            })
+            assert await hover_text(client) == "x = 1\ny = 2\n"
+            first_pid = await client.request("fake/pid")
+
+            await supervisor.recycle(session_worker(supervisor), "test")
+
+            # Same client connection, new process, same document state
+            assert await client.request("fake/pid") != first_pid
+            assert await hover_text(client) == "x = 1\ny = 2\n"
+            assert supervisor.recycled == 1
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_wedged_worker_is_recycled_after_failed_probes():
+    async def run():
+        config = make_config(probe_failures=2, probe_interval=0, probe_timeout=0.2, drain_timeout=0.2)
+        supervisor = await start_supervisor(config)
+        try:
+            client = await open_session(supervisor, "z = 3\n")
+            client.notify("fake/wedge")
+            # Requests are answered in order, so the worker is wedged once this returns
+            first_pid = await client.request("fake/pid")
+
+            # A hover that the wedged worker will never answer
+            stuck = asyncio.ensure_future(hover_text(client))
+            await supervisor.check_workers()
+            await supervisor.check_workers()
+
+            # The stuck request is failed during handover so the editor can retry it
+            with pytest.raises(LspResponseError) as excinfo:
+                await stuck
+            assert excinfo.value.code == -32801
+            assert await client.request("fake/pid") != first_pid
+            assert await hover_text(client) == "z = 3\n"
+            assert supervisor.recycled == 1
+            assert session_worker(supervisor).probe_failures == 0
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_health_endpoints():
+    async def run():
+        supervisor = await start_supervisor(make_config())
+        try:
+            def get(path):
+                url = f"http://127.0.0.1:{supervisor.health_port}{path}"
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    return response.status, response.read().decode()
+
+            status, body = await asyncio.to_thread(get, "/readyz")
+            assert (status, body) == (200, "ready\n")
+            status, body = await asyncio.to_thread(get, "/status")
+            assert '"spares": 1' in body
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_formatting_is_served_from_cache():
+    async def run():
+        supervisor = await start_supervisor(make_config())
+        try:
+            client = await open_session(supervisor, "x=1\n")
+            params = {"textDocument": {"uri": URI}, "options": {"tabSize": 4, "insertSpaces": True}}
+
+            edits = await client.request("textDocument/formatting", params)
+            assert edits[0]["newText"] == "x = 1\n"
+            # Unchanged text: same edits, straight from the cache
+            assert await client.request("textDocument/formatting", params) == edits
+            assert await client.request("fake/formatCount") == 1
+
+            # Once the editor applies the edits, the result is known to be formatted already
+            client.notify("textDocument/didChange", {
+                "textDocument": {"uri": URI, "version": 2},
+                "contentChanges": [{"text": "x = 1\n"}]
+            })
+            assert await client.request("textDocument/formatting", params) == []
+            assert await client.request("fake/formatCount") == 1
+            assert supervisor.format_cache.stats()["hits"] == 2
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_workspace_symbols_and_references_come_from_the_index(tmp_path):
+    (tmp_path / "models.py").write_text("class Invoice:\n    pass\n")
+    (tmp_path / "legacy.py").write_text("class Invoice:\n    pass\n\n\nInvoice()\n")
+    (tmp_path / "billing.py").write_text("from models import Invoice\n\ninvoice = Invoice()\n")
+    root_uri = tmp_path.as_uri()
+    editor_uri = (tmp_path / "billing.py").as_uri()
+
+    async def run():
+        supervisor = await start_supervisor(make_config(symbol_index=1, root_uri=root_uri))
+        try:
+            client = await LspClient.connect("127.0.0.1", supervisor.port)
+            capabilities = await client.initialize({"rootUri": root_uri})
+            assert capabilities["workspaceSymbolProvider"] is True
+            await supervisor.symbol_index.scan()
+
+            # The unsaved buffer wins over the file on disk
+            client.notify("textDocument/didOpen", {"textDocument": {
+                "uri": editor_uri, "languageId": "python", "version": 1,
+                "text": "from models import Invoice\n\n\ndef bill():\n    return Invoice()\n",
+            }})
+            symbols = await client.request("workspace/symbol", {"query": "inv"})
+            assert [(s["name"], s["kind"]) for s in symbols] == [("Invoice", 5), ("Invoice", 5)]
+
+            references = await client.request("textDocument/references", {
+                "textDocument": {"uri": editor_uri},
+                "position": {"line": 4, "character": 14},
+                "context": {"includeDeclaration": True},
+            })
+            assert sorted((r["uri"], r["range"]["start"]["line"]) for r in references) == [
+                (editor_uri, 0), (editor_uri, 4), ((tmp_path / "models.py").as_uri(), 0),
+            ]
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_tracing_splits_requests_into_phases_and_exports_metrics(tmp_path):
+    trace_path = tmp_path / "trace.json"
+
+    async def run():
+        supervisor = await start_supervisor(make_config(trace=1, trace_path=str(trace_path)))
+        try:
+            client = await open_session(supervisor, "x = 1\n")
+            response = await client.send_request("textDocument/hover", {
+                "textDocument": {"uri": URI}, "position": {"line": 0, "character": 0}
+            })
+            assert "_timing" not in response
+            await client.close()
+
+            def get(path):
+                url = f"http://127.0.0.1:{supervisor.health_port}{path}"
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    return response.read().decode()
+
+            return await asyncio.to_thread(get, "/metrics")
+        finally:
+            await supervisor.stop()
+
+    metrics = asyncio.run(run())
+    assert 'pylsp_request_duration_seconds_count{method="textDocument/hover",outcome="ok"} 1' in metrics
+    assert 'pylsp_request_phase_seconds_count{method="textDocument/hover",phase="handle"} 1' in metrics
+    assert 'pylsp_plugin_hook_seconds_count{hook="pylsp_hover",plugin="jedi_hover",method="textDocument/hover"} 1' \
+        in metrics
+    assert "pylsp_sessions 0" in metrics
+
+    names = {event["name"] for event in load_trace(trace_path)}
+    assert {"initialize", "textDocument/hover", "queue", "jedi_hover.pylsp_hover",
+            "textDocument/didOpen", "fake_plugin.pylsp_document_did_open"} <= names
+
+
+def test_references_to_locals_and_attributes_are_left_to_the_worker(tmp_path):
+    (tmp_path / "a.py").write_text('class Config:\n    name = "x"\n')
+    text = "def f(name):\n    return name\n\n\ndef g():\n    name = 1\n    return name\n\n\ng()\n"
+    (tmp_path / "b.py").write_text(text)
+    root_uri = tmp_path.as_uri()
+    editor_uri = (tmp_path / "b.py").as_uri()
+
+    async def run():
+        supervisor = await start_supervisor(make_config(symbol_index=1, root_uri=root_uri))
+        try:
+            client = await LspClient.connect("127.0.0.1", supervisor.port)
+            await client.initialize({"rootUri": root_uri})
+            await supervisor.symbol_index.scan()
+            client.notify("textDocument/didOpen", {"textDocument": {
+                "uri": editor_uri, "languageId": "python", "version": 1, "text": text,
+            }})
+
+            async def references(line, character):
+                return await client.request("textDocument/references", {
+                    "textDocument": {"uri": editor_uri},
+                    "position": {"line": line, "character": character},
+                    "context": {"includeDeclaration": True},
+                })
+
+            # The fake worker answers references with null; the index never does
+            assert await references(6, 12) is None
+            assert await references(1, 12) is None
+            assert [r["range"]["start"]["line"] for r in await references(9, 0)] == [4, 9]
+
+            # Messages that arrive while the index is consulted are held back, not lost
+            pending = asyncio.ensure_future(references(6, 12))
+            client.notify("textDocument/didChange", {
+                "textDocument": {"uri": editor_uri, "version": 2}, "contentChanges": [{"text": "x = 1\n"}]
+            })
+            hover = await client.request("textDocument/hover", {
+                "textDocument": {"uri": editor_uri}, "position": {"line": 0, "character": 0}
+            })
+            assert await pending is None
+            assert hover["contents"] == "x = 1\n"
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_client_leaving_during_a_handover_does_not_leak_the_replacement():
+    async def run():
+        supervisor = await start_supervisor(make_config(drain_timeout=1))
+        try:
+            client = await open_session(supervisor, "x = 1\n")
+            client.notify("fake/wedge", None)
+            # An unanswered hover keeps the handover draining
+            client.send_request("textDocument/hover", {
+                "textDocument": {"uri": URI}, "position": {"line": 0, "character": 0}
+            })
+            recycling = asyncio.create_task(supervisor.recycle(session_worker(supervisor), "test"))
+            await asyncio.sleep(0.2)
+            await client.close()
+            await recycling
+
+            assert supervisor.sessions == set()
+            assert [worker for worker in supervisor.workers if worker.session is not None] == []
+            assert [worker for worker in supervisor.workers
+                    if worker.state == "ready" and worker not in supervisor.spares] == []
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_client_shutdown_and_exit_is_not_treated_as_a_crash():
+    async def run():
+        supervisor = await start_supervisor(make_config())
+        try:
+            client = await open_session(supervisor, "x = 1\n")
+            await client.request("shutdown", None)
+            client.notify("exit", None)
+            # Like pylsp's own server, the supervisor hangs up once the worker has exited
+            for _ in range(100):
+                if client.closed:
+                    break
+                await asyncio.sleep(0.05)
+            assert client.closed
+            await asyncio.sleep(0.2)
+            assert supervisor.recycled == 0
+            assert not supervisor.sessions
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_reply_to_a_dead_workers_request_does_not_drop_the_session(monkeypatch):
+    async def run():
+        supervisor = await start_supervisor(make_config())
+        try:
+            client = await open_session(supervisor, "x = 1\n")
+            await hover_text(client)
+            (session,) = supervisor.sessions
+            session.server_requests.add("progress-1")
+
+            def dead(message):
+                raise ConnectionError("worker exited")
+
+            monkeypatch.setattr(session.worker, "send", dead)
+            session.from_client({"jsonrpc": "2.0", "id": "progress-1", "result": None})
+            assert "progress-1" not in session.server_requests
+            monkeypatch.undo()
+            assert await hover_text(client) == "x = 1\n"
+            await client.close()
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
+
+
+def test_initialization_options_are_part_of_the_format_cache_key():
+    async def run():
+        supervisor = await start_supervisor(make_config(format_cache_mb=32.0))
+        try:
+            params = {"textDocument": {"uri": URI}, "options": {"tabSize": 4, "insertSpaces": True}}
+            for line_length in (88, 100, 88):
+                client = await LspClient.connect("127.0.0.1", supervisor.port)
+                await client.initialize({
+                    "rootUri": "file:///app/workspace",
+                    "initializationOptions": {"pylsp": {"plugins": {"black": {"line_length": line_length}}}},
+                })
+                client.notify("textDocument/didOpen", {
+                    "textDocument": {"uri": URI, "languageId": "python", "version": 1, "text": "x=1\n"}
+                })
+                await client.request("textDocument/formatting", params)
+                await client.close()
+            stats = supervisor.format_cache.stats()
+            assert (stats["misses"], stats["hits"]) == (2, 1)
+        finally:
+            await supervisor.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,221 @@
+import asyncio
+
+from lsp_symbol_index import (
+    KIND_CLASS,
+    KIND_CONSTANT,
+    KIND_FIELD,
+    KIND_FUNCTION,
+    KIND_METHOD,
+    SCOPE_ATTRIBUTE,
+    SCOPE_CLASS,
+    SCOPE_IMPORT,
+    SCOPE_LOCAL,
+    SCOPE_MODULE,
+    SymbolIndex,
+    extract,
+)
+
+SOURCE = '''import os
+from shapes.base import (Shape,
+                         Point as P)
+
+MAX_SIDES = 12
+
+
+class Polygon(Shape):
+    sides: int = 3
+
+    def area(self, scale):
+        result = self.sides * scale
+        return result
+
+
+def make_polygon():
+    return Polygon()
+'''
+
+
+def test_extract_definitions_references_and_imports():
+    symbols, refs, imports = extract(SOURCE)
+    assert [(name, kind, container, line) for name, kind, container, line, *_ in symbols] == [
+        ("MAX_SIDES", KIND_CONSTANT, None, 4),
+        ("Polygon", KIND_CLASS, None, 7),
+        ("sides", KIND_FIELD, "Polygon", 8),
+        ("area", KIND_METHOD, "Polygon", 10),
+        ("make_polygon", KIND_FUNCTION, None, 15),
+    ]
+    # Function locals are references, never workspace symbols
+    assert ("result", 11, 8, 14, 1, SCOPE_LOCAL, None) in refs
+    assert ("Shape", 1, 25, 30, 0, SCOPE_IMPORT, "shapes.base") in refs
+    assert ("Point", 2, 25, 30, 0, SCOPE_IMPORT, "shapes.base") in refs
+    assert ("Polygon", 16, 11, 18, 0, SCOPE_MODULE, None) in refs
+    assert ("sides", 8, 4, 9, 1, SCOPE_CLASS, None) in refs
+    assert ("sides", 11, 22, 27, 0, SCOPE_ATTRIBUTE, None) in refs
+    assert imports == [("os", None, None, 0), ("shapes.base", "Shape", None, 1), ("shapes.base", "Point", "P", 1)]
+
+
+SHADOWING = '''name = "module"
+
+
+def uses_module_name():
+    return name
+
+
+def takes_name(name):
+    return name
+
+
+def binds_name():
+    name = 1
+    squares = [name for name in range(3)]
+    return name
+
+
+class Config:
+    name = "x"
+
+    def describe(self):
+        return self.name
+'''
+
+
+def test_locals_class_members_and_attributes_are_not_module_names(tmp_path):
+    path = str(tmp_path / "module.py")
+
+    async def run():
+        index = SymbolIndex(str(tmp_path / "symbols.sqlite"), str(tmp_path))
+        await index.open()
+        index.buffer_opened(path, SHADOWING)
+
+        async def at(line, character):
+            return await index.definition_at(path, {"line": line, "character": character})
+
+        assert await at(0, 2) == (path, "name")
+        assert await at(4, 12) == (path, "name")  # module-level name used inside a function
+        assert await at(7, 16) is None  # parameter
+        assert await at(8, 12) is None
+        assert await at(12, 4) is None  # local that shadows the module-level name
+        assert await at(13, 15) is None  # comprehension variable
+        assert await at(18, 4) is None  # class attribute
+        assert await at(21, 21) is None  # attribute access
+        assert await at(21, 8) is None  # a keyword, not a name
+        # Until the buffer parses again its old positions cannot be trusted
+        index.buffer_changed(path, "def broken(:\n" + SHADOWING)
+        assert await at(1, 2) is None
+        await index.close()
+
+    asyncio.run(run())
+
+
+def test_columns_are_utf16():
+    symbols, refs, _ = extract('s = "🐍é"; CONSTANT = s\n')
+    (constant,) = [symbol for symbol in symbols if symbol[0] == "CONSTANT"]
+    assert constant[3:] == (0, 11, 0, 19)
+
+
+def test_scan_is_incremental_and_search_ranks_prefix_before_fuzzy(tmp_path):
+    (tmp_path / "shapes.py").write_text(SOURCE)
+    (tmp_path / "broken.py").write_text("def polish(:\n")
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / ".hidden" / "skipped.py").write_text("def polygon_hidden(): pass\n")
+    db_path = tmp_path / ".index" / "symbols.sqlite"
+
+    async def run():
+        index = SymbolIndex(str(db_path), str(tmp_path))
+        await index.open()
+        assert (await index.scan())["indexed"] == 2
+        assert (await index.scan())["indexed"] == 0
+
+        names = [symbol["name"] for symbol in await index.search("poly")]
+        assert names == ["Polygon", "make_polygon"]
+        names = [symbol["name"] for symbol in await index.search("mpl")]
+        assert names == ["make_polygon"]
+        await index.close()
+
+        # The database survives a restart, and deleted files drop out on the next scan
+        (tmp_path / "shapes.py").unlink()
+        index = SymbolIndex(str(db_path), str(tmp_path))
+        await index.open()
+        assert index.has_definition("Polygon")
+        assert (await index.scan())["removed"] == 1
+        assert not index.has_definition("Polygon")
+        await index.close()
+
+    asyncio.run(run())
+
+
+def test_open_buffers_override_disk_until_closed(tmp_path):
+    path = str(tmp_path / "module.py")
+    (tmp_path / "module.py").write_text("def old_name(): pass\n")
+
+    async def run():
+        index = SymbolIndex(str(tmp_path / "symbols.sqlite"), str(tmp_path))
+        await index.open()
+        await index.scan()
+        index.buffer_opened(path, "def old_name(): pass\n")
+        index.buffer_changed(path, "def new_name(): pass\n\nnew_name()\n")
+        # Pending edits are flushed before a query runs
+        assert [symbol["name"] for symbol in await index.search("new")] == ["new_name"]
+        assert len(await index.references((path, "new_name"))) == 2
+        # Shadowing locals are not references to the module-level name
+        index.buffer_changed(path, "def new_name(): pass\n\nnew_name()\n\ndef f(new_name):\n    return new_name\n")
+        assert len(await index.references((path, "new_name"))) == 2
+        assert len(await index.references((path, "new_name"), include_declaration=False)) == 1
+
+        # A syntax error while typing keeps the last good entries
+        index.buffer_changed(path, "def new_name(:\n")
+        assert [symbol["name"] for symbol in await index.search("new")] == ["new_name"]
+
+        index.buffer_closed(path)
+        assert [symbol["name"] for symbol in await index.search("old")] == ["old_name"]
+        assert await index.search("new") == []
+        await index.close()
+
+    asyncio.run(run())
+
+
+def test_references_follow_imports_not_names(tmp_path):
+    files = {
+        "utils.py": "def helper():\n    pass\n",
+        "a.py": "import utils\n\nutils.helper()\n",
+        "b.py": "def helper():\n    pass\n\n\nhelper()\n",
+        "c.py": "from utils import helper as run\nimport utils as u\n\nrun()\nu.helper()\n",
+        "pkg/__init__.py": "from utils import helper\n",
+        "pkg/d.py": "from . import helper as unrelated\nfrom pkg import helper\n\nhelper()\n",
+        "src/lib/__init__.py": "",
+        "src/lib/e.py": "from utils import *\nfrom lib.f import thing\n\nhelper()\n",
+        "src/lib/f.py": "thing = 1\n",
+    }
+    for name, text in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(text)
+
+    def path(name):
+        return str(tmp_path / name)
+
+    async def run():
+        index = SymbolIndex(str(tmp_path / ".index" / "symbols.sqlite"), str(tmp_path))
+        await index.open()
+        await index.scan()
+
+        async def references(name, line, character):
+            definition = await index.definition_at(path(name), {"line": line, "character": character})
+            if definition is None:
+                return None
+            return sorted(
+                (location["uri"][len(tmp_path.as_uri()) + 1:], location["range"]["start"]["line"])
+                for location in await index.references(definition)
+            )
+
+        helper = [("a.py", 2), ("c.py", 0), ("c.py", 3), ("c.py", 4), ("pkg/__init__.py", 0),
+                  ("pkg/d.py", 0), ("pkg/d.py", 1), ("pkg/d.py", 3), ("src/lib/e.py", 3), ("utils.py", 0)]
+        assert await references("utils.py", 0, 5) == helper
+        assert await references("a.py", 2, 8) == helper
+        assert await references("c.py", 3, 0) == helper
+        assert await references("pkg/d.py", 3, 0) == helper
+        assert await references("b.py", 4, 0) == [("b.py", 0), ("b.py", 4)]
+        assert await references("src/lib/e.py", 1, 20) == [("src/lib/e.py", 1), ("src/lib/f.py", 0)]
+        assert await references("a.py", 0, 8) is None  # a module, not a definition
+        await index.close()
+
+    asyncio.run(run())
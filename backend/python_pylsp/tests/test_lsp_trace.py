@@ -0,0 +1,135 @@
+import re
+import types
+
+import pluggy
+
+from lsp_trace import (
+    TIMING_FIELD,
+    TIMING_NOTIFICATION,
+    Histogram,
+    Tracer,
+    WorkerInstrumentation,
+    instrument_plugins,
+    load_trace,
+    metric_lines,
+)
+
+hookspec = pluggy.HookspecMarker("pylsp")
+hookimpl = pluggy.HookimplMarker("pylsp")
+
+
+class Spec:
+    @hookspec
+    def pylsp_completions(self, document):
+        pass
+
+
+class SlowCompletions:
+    @hookimpl
+    def pylsp_completions(self, document):
+        return [{"label": document.upper()}]
+
+
+def make_plugin_manager():
+    manager = pluggy.PluginManager("pylsp")
+    manager.add_hookspecs(Spec)
+    manager.register(SlowCompletions(), name="rope_completion")
+    instrument_plugins(manager)
+    instrument_plugins(manager)  # re-initialize must not time hooks twice
+    return manager
+
+
+def make_endpoint(manager, sent):
+    def handle_request(msg_id, method, params):
+        result = manager.hook.pylsp_completions(document=params["text"])
+        endpoint._consumer({"jsonrpc": "2.0", "id": msg_id, "result": result})
+
+    def handle_notification(method, params):
+        manager.hook.pylsp_completions(document="")
+
+    endpoint = types.SimpleNamespace(
+        _consumer=sent.append, _handle_request=handle_request, _handle_notification=handle_notification
+    )
+    return endpoint
+
+
+def test_histogram_and_metric_rendering():
+    histogram = Histogram("latency_seconds", "Latency.", ("method",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(('text/"x"',), value)
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{method="text/\\"x\\"",le="0.1"} 2',
+        'latency_seconds_bucket{method="text/\\"x\\"",le="1.0"} 3',
+        'latency_seconds_bucket{method="text/\\"x\\"",le="+Inf"} 4',
+        'latency_seconds_sum{method="text/\\"x\\""} 3.65',
+        'latency_seconds_count{method="text/\\"x\\""} 4',
+    ]
+    assert metric_lines("up", "gauge", "Up.", [({}, 1), ({"worker": 2}, 0.5)])[2:] == ["up 1", 'up{worker="2"} 0.5']
+
+
+def test_worker_instrumentation_times_requests_notifications_and_background_hooks():
+    manager = make_plugin_manager()
+    sent = []
+    endpoint = make_endpoint(manager, sent)
+    WorkerInstrumentation(endpoint)
+
+    endpoint._handle_request(7, "textDocument/completion", {"text": "os"})
+    (response,) = sent
+    assert response["result"] == [[{"label": "OS"}]]
+    timing = response[TIMING_FIELD]
+    assert timing["finished"] >= timing["dequeued"]
+    assert [hook[:2] for hook in timing["hooks"]] == [["pylsp_completions", "rope_completion"]]
+
+    endpoint._handle_notification("textDocument/didOpen", {})
+    assert sent[1]["method"] == TIMING_NOTIFICATION
+    assert sent[1]["params"]["method"] == "textDocument/didOpen"
+
+    # Hooks run outside any message (debounced linting) ride on the next message from that thread
+    manager.hook.pylsp_completions(document="")
+    endpoint._consumer({"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics", "params": {}})
+    assert len(sent[2][TIMING_FIELD]["hooks"]) == 1
+    endpoint._consumer({"jsonrpc": "2.0", "method": "window/logMessage", "params": {}})
+    assert TIMING_FIELD not in sent[3]
+
+
+def test_slow_sampled_requests_are_profiled(tmp_path):
+    manager = make_plugin_manager()
+    sent = []
+    endpoint = make_endpoint(manager, sent)
+    WorkerInstrumentation(endpoint, str(tmp_path), profile_sample=1.0, profile_slow_ms=0.0, profile_keep=2)
+
+    for request_id in range(3):
+        endpoint._handle_request(request_id, "textDocument/completion", {"text": "x"})
+    profiles = [message[TIMING_FIELD]["profile"] for message in sent]
+    assert all(re.search(r"-textDocument_completion-\d+ms\.prof$", profile) for profile in profiles)
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(p.rsplit("/", 1)[1] for p in profiles[1:])
+
+
+def test_tracer_writes_a_loadable_trace_log(tmp_path):
+    path = tmp_path / "trace.json"
+    tracer = Tracer(str(path))
+    trace = tracer.begin(1, 5, "textDocument/hover")
+    trace.forwarded = trace.received + 0.001
+    trace.worker = {
+        "dequeued": trace.received + 0.002,
+        "finished": trace.received + 0.010,
+        "hooks": [["pylsp_hover", "jedi_hover", trace.received + 0.003, 0.005]],
+        "profile": "/tmp/hover.prof",
+    }
+    tracer.finish(trace, {"id": 5, "result": None})
+    cached = tracer.begin(1, 6, "textDocument/formatting")
+    tracer.finish(cached, {"id": 6, "result": []})
+    tracer.close()
+
+    events = [event for event in load_trace(path) if event["ph"] == "X"]
+    assert [event["name"] for event in events] == [
+        "textDocument/hover", "backlog", "queue", "handle", "reply", "jedi_hover.pylsp_hover",
+        "textDocument/formatting", "supervisor",
+    ]
+    assert events[0]["args"]["profile"] == "/tmp/hover.prof"
+    assert events[5]["dur"] == 5000
+    assert tracer.phase_seconds.count(("textDocument/hover", "handle")) == 1
+    assert tracer.phase_seconds.count(("textDocument/formatting", "supervisor")) == 1
+    assert tracer.profiles == 1